@@ -0,0 +1,152 @@
+"""
+Бенчмарк стоимости одного входящего апдейта для слоя БД.
+
+Сравнивает старую схему (новое sqlite3.connect на каждый запрос)
+с пулом долгоживущих соединений в режиме WAL из database.Database на тех
+же запросах и коммитах, и отдельной строкой - текущий путь: кэш списка
+менеджеров и одна транзакция на все связи апдейта.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_db.py --updates 2000 --managers 3
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TMP_DIR = tempfile.mkdtemp(prefix="bench_db_")
+os.environ.setdefault("INITIAL_MANAGERS", "")
+os.environ.setdefault("DATABASE_NAME", os.path.join(TMP_DIR, "global.db"))
+
+from database import Database  # noqa: E402
+
+
+def legacy_update(db_name: str, user_id: int, managers_count: int, message_id: int):
+    """Один апдейт в стиле старого кода: соединение на каждый запрос"""
+    with sqlite3.connect(db_name) as conn:
+        conn.execute("SELECT 1 FROM managers WHERE user_id = ?", (user_id,)).fetchone()
+
+    with sqlite3.connect(db_name) as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT first_message_sent FROM users WHERE user_id = ?", (user_id,))
+        if cursor.fetchone() is None:
+            cursor.execute("INSERT INTO users (user_id, first_message_sent) VALUES (?, 1)", (user_id,))
+            conn.commit()
+
+    with sqlite3.connect(db_name) as conn:
+        conn.execute("SELECT manager_replied FROM users WHERE user_id = ?", (user_id,)).fetchone()
+
+    with sqlite3.connect(db_name) as conn:
+        managers = conn.execute("SELECT user_id, username FROM managers").fetchall()
+
+    for manager_id, _ in managers[:managers_count]:
+        with sqlite3.connect(db_name) as conn:
+            conn.execute(
+                "INSERT INTO message_mapping (manager_message_id, user_id, manager_chat_id) VALUES (?, ?, ?)",
+                (message_id, user_id, manager_id)
+            )
+            conn.commit()
+
+
+def pool_update(database: Database, user_id: int, managers_count: int, message_id: int):
+    """Запросы и коммиты как в legacy_update, но через пул соединений Database (WAL)"""
+    with database._connection() as conn:
+        conn.execute("SELECT 1 FROM managers WHERE user_id = ?", (user_id,)).fetchone()
+
+    with database._transaction() as conn:
+        cursor = conn.execute("SELECT first_message_sent FROM users WHERE user_id = ?", (user_id,))
+        if cursor.fetchone() is None:
+            conn.execute("INSERT INTO users (user_id, first_message_sent) VALUES (?, 1)", (user_id,))
+
+    with database._connection() as conn:
+        conn.execute("SELECT manager_replied FROM users WHERE user_id = ?", (user_id,)).fetchone()
+
+    with database._connection() as conn:
+        managers = conn.execute("SELECT user_id, username FROM managers").fetchall()
+
+    for manager_id, _ in managers[:managers_count]:
+        with database._transaction() as conn:
+            conn.execute(
+                "INSERT INTO message_mapping (manager_message_id, user_id, manager_chat_id) VALUES (?, ?, ?)",
+                (message_id, user_id, manager_id)
+            )
+
+
+def pooled_update(database: Database, user_id: int, managers_count: int, message_id: int):
+    """Текущий путь: кэш списка менеджеров и запросы AsyncDatabase, все записи одной транзакцией"""
+    database.is_manager(user_id)
+    state = database.load_user_state(user_id)
+    managers = database.get_all_managers()
+    mappings = [(message_id, user_id, manager_id) for manager_id, _ in managers[:managers_count]]
+    database.write_batch(mappings, [] if state else [(user_id, True, False)])
+
+
+def prepare(db_name: str, managers_count: int) -> Database:
+    """Создать схему и менеджеров"""
+    database = Database(db_name)
+    for i in range(managers_count):
+        database.add_manager(1_000_000 + i, f"manager_{i}")
+    return database
+
+
+def run(label: str, func, updates: int, users: int) -> float:
+    """Прогнать updates апдейтов, вернуть среднее время в мс"""
+    started = time.perf_counter()
+    for i in range(updates):
+        func(i % users, i)
+    elapsed = time.perf_counter() - started
+    per_update = elapsed / updates * 1000
+    print(f"{label:<28} {per_update:8.3f} мс/апдейт  ({updates / elapsed:8.0f} апдейтов/с)")
+    return per_update
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--managers", type=int, default=3)
+    args = parser.parse_args()
+
+    legacy_db = os.path.join(TMP_DIR, "legacy.db")
+    pool_db = os.path.join(TMP_DIR, "pool.db")
+    pooled_db = os.path.join(TMP_DIR, "pooled.db")
+
+    # Старая схема: journal_mode по умолчанию (DELETE), synchronous FULL
+    legacy = prepare(legacy_db, args.managers)
+    legacy.close()
+    with sqlite3.connect(legacy_db) as conn:
+        conn.execute("PRAGMA journal_mode = DELETE")
+
+    pool = prepare(pool_db, args.managers)
+    pooled = prepare(pooled_db, args.managers)
+
+    print(f"Апдейтов: {args.updates}, пользователей: {args.users}, менеджеров: {args.managers}\n")
+    before = run(
+        "до (connect на запрос)",
+        lambda user_id, i: legacy_update(legacy_db, user_id, args.managers, i),
+        args.updates, args.users
+    )
+    after = run(
+        "пул + WAL",
+        lambda user_id, i: pool_update(pool, user_id, args.managers, i),
+        args.updates, args.users
+    )
+    batched = run(
+        "+ кэш менеджеров и пачка",
+        lambda user_id, i: pooled_update(pooled, user_id, args.managers, i),
+        args.updates, args.users
+    )
+    print(f"\nУскорение от пула и WAL: x{before / after:.1f}")
+    print(f"Кэш менеджеров и запись пачкой: ещё x{after / batched:.1f} (всего x{before / batched:.1f})")
+    pool.close()
+    pooled.close()
+
+
+if __name__ == "__main__":
+    main()
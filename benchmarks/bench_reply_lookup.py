@@ -0,0 +1,80 @@
+"""
+Бенчмарк поиска пользователя по ответу менеджера (get_user_by_message)
+при растущей таблице message_mapping.
+
+С индексом idx_message_mapping_lookup задержка должна оставаться
+почти постоянной; с --without-index видно деградацию полного сканирования.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_reply_lookup.py --sizes 10000,100000,1000000,3000000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TMP_DIR = tempfile.mkdtemp(prefix="bench_lookup_")
+os.environ.setdefault("INITIAL_MANAGERS", "")
+os.environ.setdefault("DATABASE_NAME", os.path.join(TMP_DIR, "global.db"))
+
+from database import Database  # noqa: E402
+
+MANAGERS = 5
+BATCH = 100_000
+
+
+def grow(database: Database, current: int, target: int):
+    """Дописать строки до target: сообщения равномерно по MANAGERS чатам"""
+    with database._transaction() as conn:
+        for start in range(current, target, BATCH):
+            end = min(start + BATCH, target)
+            conn.executemany(
+                "INSERT INTO message_mapping (manager_message_id, user_id, manager_chat_id) VALUES (?, ?, ?)",
+                ((i // MANAGERS, 10_000 + i % 50_000, 1_000 + i % MANAGERS) for i in range(start, end))
+            )
+
+
+def measure(database: Database, rows: int, lookups: int) -> float:
+    """Средняя задержка поиска случайной существующей связи, мкс"""
+    rng = random.Random(rows)
+    keys = [rng.randrange(rows) for _ in range(lookups)]
+    started = time.perf_counter()
+    for i in keys:
+        database.get_user_by_message(i // MANAGERS, 1_000 + i % MANAGERS)
+    return (time.perf_counter() - started) / lookups * 1_000_000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000,1000000,3000000",
+                        help="размеры таблицы через запятую")
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--without-index", action="store_true",
+                        help="удалить индекс, чтобы увидеть задержку до миграции")
+    args = parser.parse_args()
+
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    database = Database(os.path.join(TMP_DIR, "lookup.db"))
+    if args.without_index:
+        with database._transaction() as conn:
+            conn.execute("DROP INDEX idx_message_mapping_lookup")
+        # Без индекса каждый поиск - полный проход, уменьшаем число запросов
+        args.lookups = min(args.lookups, 50)
+
+    print(f"{'строк':>12} {'поиск, мкс':>12}")
+    current = 0
+    for size in sizes:
+        grow(database, current, size)
+        current = size
+        print(f"{size:>12} {measure(database, size, args.lookups):>12.1f}")
+    database.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+Набор микробенчмарков горячего пути: поиск автоответов, слой БД и
+формирование уведомления менеджерам.
+
+Корпус сообщений и наполнение БД синтетические и фиксированные (seed),
+поэтому результаты двух коммитов можно сравнивать напрямую. Итог
+пишется в JSON; --compare печатает изменение относительно прошлого файла.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_suite.py --output before.json
+    python benchmarks/bench_suite.py --output after.json --compare before.json
+    python benchmarks/bench_suite.py --only matcher --db-sizes 10000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TMP_DIR = tempfile.mkdtemp(prefix="bench_suite_")
+os.environ.setdefault("INITIAL_MANAGERS", "")
+os.environ.setdefault("DATABASE_NAME", os.path.join(TMP_DIR, "global.db"))
+
+from database import AsyncDatabase, Database, UserStateCache  # noqa: E402
+from matcher import AutoReplyMatcher, normalize_text  # noqa: E402
+from config import AUTO_REPLIES  # noqa: E402
+
+SEED = 20240601
+CORPUS_SIZE = 5_000
+MANAGERS = 5
+BATCH = 100_000
+# Изменение больше этой доли считается регрессией в --compare
+REGRESSION_THRESHOLD = 0.10
+
+GREETINGS = ["Здравствуйте!", "Добрый день,", "Привет", "Доброго вечера.", ""]
+FILLER = [
+    "хотим", "на", "пятницу", "субботу", "нас", "человек", "подскажите", "пожалуйста",
+    "день рождения", "у подруги", "компанией", "вечером", "можно ли", "забронировать",
+    "спасибо", "а", "ещё", "вопрос", "игру", "в", "марте", "детей", "взрослых",
+]
+TYPOS = ["стоимасть", "карпоратив", "скока стоит", "адресс", "продолжительнось"]
+
+
+def build_corpus(size: int) -> list:
+    """Сообщения пользователей: приветствие, ключевая фраза или опечатка, случайные слова"""
+    rng = random.Random(SEED)
+    keywords = [keyword for item in AUTO_REPLIES for keyword in item["keywords"]]
+    corpus = []
+    for _ in range(size):
+        parts = [rng.choice(GREETINGS)]
+        roll = rng.random()
+        if roll < 0.5:
+            parts.append(rng.choice(keywords))
+        elif roll < 0.6:
+            parts.append(rng.choice(TYPOS))
+        parts.extend(rng.choice(FILLER) for _ in range(rng.randint(0, 8)))
+        rng.shuffle(parts)
+        text = " ".join(part for part in parts if part)
+        corpus.append(text + rng.choice(["", "?", "!", "..."]))
+    return corpus
+
+
+def build_short_traffic(size: int, short: int = 300, distinct: int = 4_000, skew: float = 1.1) -> list:
+    """
+    Трафик, ради которого есть кэш: по Ципфу повторяются частые короткие сообщения
+    («цена», «адрес?»), а длинный хвост - разные длинные (больше, чем вмещает кэш)
+    """
+    rng = random.Random(SEED + 1)
+    keywords = [keyword for item in AUTO_REPLIES for keyword in item["keywords"]]
+    texts = []
+    seen = set()
+    while len(texts) < short:
+        text = rng.choice(keywords + TYPOS)
+        if rng.random() < 0.3:
+            text = text.capitalize()
+        if rng.random() < 0.3:
+            text = f"{rng.choice(GREETINGS)} {text}".strip()
+        text += rng.choice(["", "?", "!", "??"])
+        if text not in seen:
+            seen.add(text)
+            texts.append(text)
+    texts.extend(text for text in dict.fromkeys(build_corpus(distinct * 2)) if text not in seen)
+    del texts[distinct:]
+    distinct = len(texts)
+    weights = [1 / rank ** skew for rank in range(1, distinct + 1)]
+    return rng.choices(texts, weights, k=size)
+
+
+def timeit(func, items, rounds: int) -> dict:
+    """Прогнать func по всем items rounds раз; задержка на операцию в мкс"""
+    per_op = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for item in items:
+            func(item)
+        per_op.append((time.perf_counter() - started) / len(items) * 1_000_000)
+    median = statistics.median(per_op)
+    return {
+        "ops": len(items) * rounds,
+        "median_us": round(median, 3),
+        "best_us": round(min(per_op), 3),
+        "ops_per_sec": round(1_000_000 / median) if median else None,
+    }
+
+
+def atimeit(loop, func, items, rounds: int, setup=None, finish=None) -> dict:
+    """
+    timeit для корутин: все items одного раунда проходят в одном запуске loop.
+    setup() вызывается перед раундом вне замера, finish() - в конце раунда в замере.
+    """
+    async def one_round():
+        for item in items:
+            await func(item)
+        if finish:
+            await finish()
+
+    per_op = []
+    for _ in range(rounds):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        loop.run_until_complete(one_round())
+        per_op.append((time.perf_counter() - started) / len(items) * 1_000_000)
+    median = statistics.median(per_op)
+    return {
+        "ops": len(items) * rounds,
+        "median_us": round(median, 3),
+        "best_us": round(min(per_op), 3),
+        "ops_per_sec": round(1_000_000 / median) if median else None,
+    }
+
+
+def bench_matcher(rounds: int) -> dict:
+    corpus = build_corpus(CORPUS_SIZE)
+    short = build_short_traffic(CORPUS_SIZE)
+    # Без кэша - чтобы измерять сам поиск, а не попадания в LRU
+    uncached = AutoReplyMatcher(AUTO_REPLIES, cache_size=0)
+    cached = AutoReplyMatcher(AUTO_REPLIES)
+    results = {
+        "normalize_text": timeit(normalize_text, corpus, rounds),
+        "find_auto_reply": timeit(uncached.match, corpus, rounds),
+        # Кэш сравнивается с поиском без кэша на одном и том же повторяющемся трафике
+        "find_auto_reply_short": timeit(uncached.match, short, rounds),
+        "find_auto_reply_cached": timeit(cached.match, short, rounds),
+    }
+    results["find_auto_reply_cached"]["hit_ratio"] = round(cached.cache.stats()["hit_ratio"], 3)
+    return results
+
+
+def bench_rendering(rounds: int) -> dict:
+    from handlers import format_manager_notification
+
+    rng = random.Random(SEED)
+    users = [
+        SimpleNamespace(
+            id=10_000 + i,
+            first_name=rng.choice(["Анна", "Иван", "Мария", None]),
+            last_name=rng.choice(["Петрова", "Смирнов", None]),
+            username=rng.choice([f"user_{i}", None]),
+        )
+        for i in range(CORPUS_SIZE)
+    ]
+    items = list(zip(users, build_corpus(CORPUS_SIZE)))
+    return {
+        "format_manager_notification": timeit(
+            lambda item: format_manager_notification(item[0], item[1], False, True),
+            items, rounds
+        ),
+    }
+
+
+def fill(database: Database, rows: int):
+    """Связи сообщений равномерно по MANAGERS чатам и пользователи, которым они принадлежат"""
+    users = max(1, rows // 20)
+    with database._transaction() as conn:
+        for start in range(0, rows, BATCH):
+            end = min(start + BATCH, rows)
+            conn.executemany(
+                "INSERT INTO message_mapping (manager_message_id, user_id, manager_chat_id) VALUES (?, ?, ?)",
+                ((i // MANAGERS, 10_000 + i % users, 1_000 + i % MANAGERS) for i in range(start, end))
+            )
+        conn.executemany(
+            "INSERT INTO users (user_id, first_message_sent) VALUES (?, 1)",
+            ((10_000 + i,) for i in range(users))
+        )
+    for i in range(MANAGERS):
+        database.add_manager(1_000 + i, f"manager_{i}")
+    return users
+
+
+def bench_db(rows: int, rounds: int, lookups: int) -> dict:
+    """
+    Слой БД так, как его вызывают обработчики: через AsyncDatabase (кэш
+    состояний, индекс ответов, журнал отложенной записи) и поток БД.
+    """
+    database = Database(os.path.join(TMP_DIR, f"suite_{rows}.db"))
+    users = fill(database, rows)
+    adb = AsyncDatabase(database)
+    loop = asyncio.new_event_loop()
+    rng = random.Random(SEED + rows)
+
+    mapping_keys = []
+    for _ in range(lookups):
+        i = rng.randrange(rows)
+        mapping_keys.append((i // MANAGERS, 1_000 + i % MANAGERS))
+    # Половина - менеджеры, половина - обычные пользователи
+    manager_checks = [rng.choice([1_000 + rng.randrange(MANAGERS), 10_000 + rng.randrange(users)])
+                      for _ in range(lookups)]
+    returning_users = [10_000 + rng.randrange(users) for _ in range(lookups)]
+    new_message_id = [rows // MANAGERS + 1]
+
+    def cold_cache():
+        # Как после перезапуска: каждое состояние сначала читается из SQLite
+        adb.users = UserStateCache()
+
+    async def notify(user_id):
+        # Уведомление всем менеджерам: MANAGERS связей в журнал
+        new_message_id[0] += 1
+        await adb.save_message_mappings(
+            [(new_message_id[0], user_id, 1_000 + i) for i in range(MANAGERS)]
+        )
+        if adb.pending_writes >= adb.max_pending:
+            await adb.flush()
+
+    results = {
+        "is_manager": timeit(database.is_manager, manager_checks, rounds),
+        "has_manager_replied_cold": atimeit(loop, adb.has_manager_replied, returning_users, rounds,
+                                            setup=cold_cache),
+        "has_manager_replied_cached": atimeit(loop, adb.has_manager_replied, returning_users, rounds),
+        "is_first_message": atimeit(loop, adb.is_first_message, returning_users, rounds, setup=cold_cache),
+        # Старые связи: индекс ответов их не знает, запрос идёт в SQLite
+        "get_user_by_message": atimeit(loop, lambda key: adb.get_user_by_message(*key), mapping_keys, rounds),
+        "save_message_mappings+flush": atimeit(loop, notify, returning_users, rounds, finish=adb.flush),
+    }
+    loop.run_until_complete(adb.close())
+    loop.close()
+    return results
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: dict, baseline_path: str):
+    """Напечатать изменение медианы относительно прошлого запуска"""
+    with open(baseline_path, encoding="utf-8") as file:
+        baseline = json.load(file)
+    print(f"\nСравнение с {baseline_path} ({baseline['meta'].get('revision')}):")
+    for name, result in results.items():
+        old = baseline["results"].get(name)
+        if not old:
+            print(f"  {name:<42} новый")
+            continue
+        change = result["median_us"] / old["median_us"] - 1 if old["median_us"] else 0.0
+        mark = "  РЕГРЕССИЯ" if change > REGRESSION_THRESHOLD else ""
+        print(f"  {name:<42} {old['median_us']:>10.2f} -> {result['median_us']:>10.2f} мкс  {change:+7.1%}{mark}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="bench_results.json", help="куда записать JSON")
+    parser.add_argument("--compare", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--db-sizes", default="10000,1000000", help="размеры message_mapping через запятую")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--lookups", type=int, default=2000, help="операций БД в одном раунде")
+    parser.add_argument("--only", choices=["matcher", "rendering", "db"], action="append",
+                        help="запустить только выбранные группы")
+    args = parser.parse_args()
+
+    groups = args.only or ["matcher", "rendering", "db"]
+    results = {}
+    if "matcher" in groups:
+        results.update(bench_matcher(args.rounds))
+    if "rendering" in groups:
+        results.update(bench_rendering(args.rounds))
+    if "db" in groups:
+        for rows in sorted(int(size) for size in args.db_sizes.split(",")):
+            for name, result in bench_db(rows, args.rounds, args.lookups).items():
+                results[f"{name}[{rows}]"] = result
+
+    for name, result in results.items():
+        print(f"{name:<42} {result['median_us']:>10.2f} мкс  ({result['ops_per_sec']} оп/с)")
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": SEED,
+            "rounds": args.rounds,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, ensure_ascii=False, indent=2)
+    print(f"\nРезультаты: {args.output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
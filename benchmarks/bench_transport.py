@@ -0,0 +1,108 @@
+"""
+Бенчмарк HTTP-транспорта бота против локальной заглушки Bot API.
+
+Поднимает fake_bot_api на свободном порту, собирает ExtBot через
+main.build_bot с разными размерами пула и версиями HTTP и шлёт пачки
+одновременных sendMessage, как при рассылке менеджерам. Печатает время
+пачки, отправок в секунду, p95 задержки вызова и сколько соединений
+открыл клиент.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_transport.py --pools 1,8,32,64 --burst 200 --latency 80
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TMP_DIR = tempfile.mkdtemp(prefix="bench_transport_")
+os.environ.setdefault("INITIAL_MANAGERS", "")
+os.environ.setdefault("BOT_TOKEN", "123456:TRANSPORT-BENCH")
+os.environ.setdefault("DATABASE_NAME", os.path.join(TMP_DIR, "transport.db"))
+
+from aiohttp import web  # noqa: E402
+
+from main import build_bot  # noqa: E402
+from fake_bot_api import create_app, app_stats  # noqa: E402
+
+
+# Каждый запрос логируется на INFO и httpx, и aiohttp - это мешает читать таблицу
+logging.getLogger("httpx").setLevel(logging.WARNING)
+logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def measure(base_url: str, pool_size: int, http_version: str, burst: int, rounds: int) -> dict:
+    """rounds пачек по burst одновременных sendMessage через один ExtBot"""
+    bot = build_bot(base_url=base_url, pool_size=pool_size, http_version=http_version)
+    await bot.initialize()
+    latencies = []
+
+    async def send(chat_id: int):
+        started = time.perf_counter()
+        await bot.send_message(chat_id=chat_id, text="Новое сообщение от пользователя")
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await asyncio.gather(*(send(1_000 + i) for i in range(burst)))
+    elapsed = time.perf_counter() - started
+    await bot.shutdown()
+
+    latencies.sort()
+    return {
+        "per_burst": elapsed / rounds,
+        "rate": burst * rounds / elapsed,
+        "p95": latencies[int(0.95 * (len(latencies) - 1))],
+    }
+
+
+async def run(args):
+    port = free_port()
+    app = create_app(args.latency / 1000, args.jitter / 1000)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    base_url = f"http://127.0.0.1:{port}/bot"
+
+    print(f"Заглушка Bot API: {base_url}, задержка {args.latency:g} мс, пачка {args.burst} x {args.rounds}\n")
+    print(f"{'HTTP':>5} {'пул':>5} {'пачка, мс':>10} {'отправок/с':>11} {'p95, мс':>9} {'соединений':>11}")
+    try:
+        for http_version in args.http_versions.split(","):
+            for pool_size in sorted(int(value) for value in args.pools.split(",")):
+                connections_before = app_stats(app)["connections"]
+                result = await measure(base_url, pool_size, http_version, args.burst, args.rounds)
+                connections = app_stats(app)["connections"] - connections_before
+                print(f"{http_version:>5} {pool_size:>5} {result['per_burst'] * 1000:>10.1f} "
+                      f"{result['rate']:>11.0f} {result['p95'] * 1000:>9.1f} {connections:>11}")
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pools", default="1,8,32,64", help="размеры пула соединений через запятую")
+    parser.add_argument("--http-versions", default="1.1", help="версии HTTP через запятую: 1.1,2")
+    parser.add_argument("--burst", type=int, default=100, help="одновременных отправок в пачке")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=50, help="задержка заглушки, мс")
+    parser.add_argument("--jitter", type=float, default=10, help="случайная добавка к задержке, мс")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
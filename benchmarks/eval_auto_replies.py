@@ -0,0 +1,109 @@
+"""
+Офлайн-оценка AUTO_REPLIES на выгрузке сообщений пользователей.
+
+Файл читается потоково (одно сообщение на строку) и прогоняется через
+пакетный matcher.match_many. В конце печатаются доля сообщений с
+автоответом по каждому FAQ, самые частые фразы без совпадения и
+скорость в сообщениях в секунду.
+
+Запуск из корня репозитория:
+    python benchmarks/eval_auto_replies.py messages.txt --top-unmatched 50
+    python benchmarks/eval_auto_replies.py messages.txt --verify
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import Counter
+from itertools import islice
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+os.environ.setdefault("INITIAL_MANAGERS", "")
+
+from config import FAQ_ANSWERS  # noqa: E402
+from matcher import find_auto_reply, matcher, normalize_text  # noqa: E402
+
+FAQ_KEY_BY_ANSWER = {answer: key for key, answer in FAQ_ANSWERS.items()}
+
+
+def read_messages(path: str):
+    """Непустые строки файла без перевода строки"""
+    with open(path, encoding="utf-8", errors="replace") as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="файл с сообщениями, по одному на строку")
+    parser.add_argument("--batch", type=int, default=10_000, help="сообщений в одной пачке")
+    parser.add_argument("--top-unmatched", type=int, default=20, help="сколько фраз без ответа показать")
+    parser.add_argument("--verify", action="store_true",
+                        help="сверить каждый результат с одиночным find_auto_reply")
+    args = parser.parse_args()
+
+    total = 0
+    matched = 0
+    mismatches = 0
+    by_faq = Counter()
+    by_keyword = Counter()
+    unmatched = Counter()
+    scoring_time = 0.0
+
+    messages = read_messages(args.path)
+    while True:
+        batch = list(islice(messages, args.batch))
+        if not batch:
+            break
+
+        started = time.perf_counter()
+        results = matcher.match_many(batch)
+        scoring_time += time.perf_counter() - started
+
+        for message_text, match in zip(batch, results):
+            total += 1
+            if match is None:
+                unmatched[normalize_text(message_text)] += 1
+            else:
+                matched += 1
+                by_faq[FAQ_KEY_BY_ANSWER.get(match.answer, str(match.reply_index))] += 1
+                by_keyword[match.keyword] += 1
+
+            if args.verify:
+                expected = find_auto_reply(message_text)
+                actual = (None, None) if match is None else (match.answer, match.keyword)
+                if expected != actual:
+                    mismatches += 1
+                    print(f"Расхождение: {message_text!r}: {expected[1]!r} != {actual[1]!r}")
+
+    if not total:
+        print("Сообщений не найдено")
+        return
+
+    print(f"Сообщений: {total}, с автоответом: {matched} ({matched / total:.1%})")
+    if scoring_time:
+        print(f"Скорость: {total / scoring_time:,.0f} сообщений/с\n")
+
+    print("Доля по FAQ:")
+    for faq_key, count in by_faq.most_common():
+        print(f"  {faq_key:<12} {count:>8}  {count / total:6.1%}")
+
+    print("\nСработавшие ключи:")
+    for keyword, count in by_keyword.most_common(20):
+        print(f"  {keyword:<30} {count:>8}")
+
+    print(f"\nБез автоответа (топ {args.top_unmatched}):")
+    for text, count in unmatched.most_common(args.top_unmatched):
+        print(f"  {count:>6}  {text}")
+
+    if args.verify:
+        print(f"\nРасхождений с find_auto_reply: {mismatches}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Локальная замена Bot API на aiohttp для офлайн-замеров транспорта.
+
+Поддерживаются методы, которыми пользуется бот: getMe, getUpdates,
+sendMessage, editMessageText, answerCallbackQuery, setWebhook и deleteWebhook. Каждый ответ
+задерживается на --latency мс (+ случайно до --jitter), а число
+одновременно открытых соединений и запросов видно в статистике.
+
+Запуск отдельно (бот направляется сюда через BOT_API_BASE_URL):
+    python benchmarks/fake_bot_api.py --port 8081 --latency 80
+    BOT_API_BASE_URL=http://127.0.0.1:8081/bot python main.py
+"""
+
+import argparse
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+STATS_KEY = web.AppKey("stats", dict)
+
+
+def create_app(latency: float = 0.0, jitter: float = 0.0) -> web.Application:
+    """Приложение-заглушка; latency и jitter в секундах"""
+    message_ids = itertools.count(1)
+    stats = {
+        "calls": Counter(),
+        "in_flight": 0,
+        "max_in_flight": 0,
+        "connections": set(),
+    }
+
+    async def handle(request: web.Request) -> web.Response:
+        api_method = request.match_info["path"].rsplit("/", 1)[-1]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+
+        stats["calls"][api_method] += 1
+        stats["connections"].add(request.transport and id(request.transport))
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            if api_method == "getUpdates":
+                # Long polling без апдейтов: держим соединение до таймаута
+                await asyncio.sleep(min(float(params.get("timeout") or 0), 25))
+                result = []
+            else:
+                delay = latency + random.uniform(0, jitter)
+                if delay:
+                    await asyncio.sleep(delay)
+                result = _result(api_method, params, message_ids)
+        finally:
+            stats["in_flight"] -= 1
+
+        if result is None:
+            return web.json_response(
+                {"ok": False, "error_code": 404, "description": "Not Found: method not found"},
+                status=404
+            )
+        return web.json_response({"ok": True, "result": result})
+
+    async def stats_handler(request: web.Request) -> web.Response:
+        return web.json_response(app_stats(request.app))
+
+    app = web.Application()
+    app[STATS_KEY] = stats
+    app.router.add_get("/_stats", stats_handler)
+    app.router.add_route("*", "/{path:.+}", handle)
+    return app
+
+
+def _result(api_method: str, params: dict, message_ids):
+    """Тело result для метода или None, если метод не поддерживается"""
+    if api_method == "getMe":
+        return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+    if api_method in ("sendMessage", "editMessageText"):
+        return {
+            "message_id": int(params.get("message_id") or next(message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id") or 0), "type": "private"},
+            "text": params.get("text", ""),
+        }
+    if api_method in ("answerCallbackQuery", "setWebhook", "deleteWebhook"):
+        return True
+    return None
+
+
+def app_stats(app: web.Application) -> dict:
+    """Счётчики заглушки: вызовы по методам, пик одновременных запросов, число соединений"""
+    stats = app[STATS_KEY]
+    return {
+        "calls": dict(stats["calls"]),
+        "max_in_flight": stats["max_in_flight"],
+        "connections": len(stats["connections"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=50, help="задержка ответа, мс")
+    parser.add_argument("--jitter", type=float, default=20, help="случайная добавка к задержке, мс")
+    args = parser.parse_args()
+    web.run_app(create_app(args.latency / 1000, args.jitter / 1000), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""
+Нагрузочный тест бота внутри процесса.
+
+Собирает тот же Application, что и main.main() (build_application), но
+ExtBot ходит не в Telegram, а в FakeBotRequest: он записывает вызовы
+Bot API, отвечает правдоподобным JSON и ждёт --latency мс, имитируя сеть.
+Синтетические апдейты (сообщения пользователей, ответы менеджеров,
+нажатия FAQ-кнопок) с заданной частотой кладутся в update_queue
+запущенного Application - как их кладёт polling или webhook, с той же
+настройкой concurrent_updates. Для каждой частоты и числа менеджеров
+печатаются p50/p95/p99 от постановки в очередь до конца обработки,
+ошибки обработчиков, сбои рассылки менеджерам и p95 доставки сообщения
+пользователя менеджерам (вместе с ожиданием окна серии).
+
+Запуск из корня репозитория:
+    python benchmarks/load_test.py --managers 1,5,20 --rates 50,100,200,400
+    python benchmarks/load_test.py --unlimited --latency 5 --duration 5
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import re
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TMP_DIR = tempfile.mkdtemp(prefix="load_test_")
+os.environ.setdefault("INITIAL_MANAGERS", "")
+os.environ.setdefault("BOT_TOKEN", "123456:LOAD-TEST")
+os.environ["DATABASE_NAME"] = os.path.join(TMP_DIR, "load.db")
+os.environ.setdefault("MAPPING_ARCHIVE_NAME", os.path.join(TMP_DIR, "archive.db"))
+
+from telegram import Update  # noqa: E402
+from telegram.ext import ExtBot, TypeHandler  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+from config import BOT_TOKEN, FAQ_ANSWERS  # noqa: E402
+from database import adb  # noqa: E402
+from outbound import outbound, TokenBucket  # noqa: E402
+from handlers import burst_stats, burst_deliveries, flush_bursts  # noqa: E402
+from main import build_application, write_behind_loop  # noqa: E402
+from metrics import fanout_failures  # noqa: E402
+from bench_suite import build_corpus  # noqa: E402
+
+MANAGER_BASE_ID = 1_000
+USER_BASE_ID = 100_000
+
+# ID пользователя в тексте уведомления менеджерам (format_manager_notification)
+NOTIFICATION_USER_RE = re.compile(r"ID:\s*<code>(\d+)</code>")
+
+
+class FakeBotRequest(BaseRequest):
+    """Транспорт Bot API без сети: записывает вызовы и отвечает после задержки"""
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = Counter()
+        self.call_latency = []
+        self._message_ids = itertools.count(1)
+        # Последние уведомления в чатах менеджеров: (chat_id, message_id, thread_id)
+        self.notifications = []
+        # Вызывается с user_id из текста каждого уведомления менеджерам
+        self.on_notification = None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        started = time.perf_counter()
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] += 1
+        params = request_data.parameters if request_data else {}
+
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+        result = self._result(api_method, params)
+        self.call_latency.append(time.perf_counter() - started)
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    def _result(self, api_method: str, params: dict):
+        if api_method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Load", "username": "load_test_bot"}
+        if api_method == "createForumTopic":
+            return {"message_thread_id": next(self._message_ids), "name": params.get("name", ""),
+                    "icon_color": 7322096}
+        if api_method in ("sendMessage", "editMessageText"):
+            chat_id = int(params.get("chat_id") or params.get("chat", {}).get("id", 0))
+            message_id = params.get("message_id") or next(self._message_ids)
+            thread_id = params.get("message_thread_id")
+            if api_method == "sendMessage" and (MANAGER_BASE_ID <= chat_id < USER_BASE_ID or thread_id):
+                self.notifications.append((chat_id, message_id, thread_id))
+                if len(self.notifications) > 10_000:
+                    del self.notifications[:5_000]
+                user_id = NOTIFICATION_USER_RE.search(params.get("text", ""))
+                if user_id and self.on_notification:
+                    self.on_notification(int(user_id.group(1)))
+            return {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+                "text": params.get("text", ""),
+            }
+        return True
+
+
+class UpdateFactory:
+    """Синтетические апдейты в виде JSON, как их присылает Telegram"""
+
+    def __init__(self, bot: ExtBot, request: FakeBotRequest, users: int,
+                 reply_share: float, callback_share: float):
+        self.bot = bot
+        self.request = request
+        self.users = users
+        self.reply_share = reply_share
+        self.callback_share = callback_share
+        self.managers = 1
+        self.corpus = build_corpus(5_000)
+        self.faq_keys = list(FAQ_ANSWERS)
+        self.rng = random.Random(1)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1_000_000)
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user_{user_id}"}
+
+    def _message(self, user_id: int, text: str) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+
+    def next_update(self):
+        """(вид апдейта, Update)"""
+        roll = self.rng.random()
+        data = {"update_id": next(self._update_ids)}
+        if roll < self.reply_share and self.request.notifications:
+            chat_id, message_id, thread_id = self.rng.choice(self.request.notifications[-1_000:])
+            if thread_id:
+                # Режим группы менеджеров: пишет один из менеджеров прямо в тему пользователя
+                message = self._message(MANAGER_BASE_ID + self.rng.randrange(self.managers),
+                                        "Добрый день! Да, свободно, бронируем?")
+                message["chat"] = {"id": chat_id, "type": "supergroup", "is_forum": True}
+                message["message_thread_id"] = thread_id
+                message["is_topic_message"] = True
+            else:
+                message = self._message(chat_id, "Добрый день! Да, свободно, бронируем?")
+                message["reply_to_message"] = {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "text": "уведомление",
+                }
+            data["message"] = message
+            kind = "manager_reply"
+        elif roll < self.reply_share + self.callback_share:
+            user_id = USER_BASE_ID + self.rng.randrange(self.users)
+            data["callback_query"] = {
+                "id": str(data["update_id"]),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": f"faq_{self.rng.choice(self.faq_keys)}",
+                "message": self._message(user_id, "меню"),
+            }
+            kind = "callback_query"
+        else:
+            user_id = USER_BASE_ID + self.rng.randrange(self.users)
+            data["message"] = self._message(user_id, self.rng.choice(self.corpus) or "привет")
+            kind = "user_message"
+        return kind, Update.de_json(data, self.bot)
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class UpdateTracker:
+    """
+    Замеры апдейтов, прошедших через update_queue: время до конца обработки
+    (обработчик в последней группе) и до первого уведомления менеджерам
+    о сообщении пользователя.
+    """
+
+    def __init__(self):
+        self.enqueued = {}      # update_id -> (вид, время постановки в очередь)
+        self.latencies = {}     # вид -> [секунды]
+        self.undelivered = {}   # user_id -> [время постановки его ещё не доставленных сообщений]
+        self.delivery = []
+        self.processed = 0
+        self.errors = 0
+        self.all_processed = asyncio.Event()
+        self.expected = 0
+
+    def reset(self, expected: int):
+        self.latencies.clear()
+        self.delivery.clear()
+        self.processed = 0
+        self.errors = 0
+        self.expected = expected
+        self.all_processed.clear()
+
+    def enqueue(self, kind: str, update: Update):
+        now = time.perf_counter()
+        self.enqueued[update.update_id] = (kind, now)
+        if kind == "user_message":
+            self.undelivered.setdefault(update.effective_user.id, []).append(now)
+
+    async def finished(self, update, context):
+        """Обработчик в последней группе: апдейт обработан всеми остальными"""
+        kind, started = self.enqueued.pop(update.update_id, ("unknown", time.perf_counter()))
+        self.latencies.setdefault(kind, []).append(time.perf_counter() - started)
+        self.processed += 1
+        if self.processed >= self.expected:
+            self.all_processed.set()
+
+    async def error(self, update, context):
+        self.errors += 1
+
+    def notified(self, user_id: int):
+        """Уведомление о пользователе ушло: доставлены все его ждавшие сообщения (серия)"""
+        now = time.perf_counter()
+        for started in self.undelivered.pop(user_id, ()):
+            self.delivery.append(now - started)
+
+
+def fanout_failure_count() -> float:
+    return sum(fanout_failures._values.values())
+
+
+async def run_step(application, tracker: UpdateTracker, factory: UpdateFactory,
+                   rate: float, duration: float) -> dict:
+    """Подать rate апдейтов в секунду в течение duration секунд (открытая нагрузка)"""
+    total = int(rate * duration)
+    tracker.reset(total)
+    failures_before = fanout_failure_count()
+
+    started = time.perf_counter()
+    for i in range(total):
+        # Апдейты приходят по расписанию, даже если обработка отстаёт
+        delay = started + i / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        kind, update = factory.next_update()
+        tracker.enqueue(kind, update)
+        await application.update_queue.put(update)
+    if total:
+        await tracker.all_processed.wait()
+    elapsed = time.perf_counter() - started
+    # Серии, открытые в конце шага, уходят по своему окну - дожидаемся их, не торопя
+    await asyncio.gather(*burst_deliveries, return_exceptions=True)
+
+    everything = [value for values in tracker.latencies.values() for value in values]
+    return {
+        "updates": total,
+        "elapsed": elapsed,
+        "throughput": total / elapsed if elapsed else 0.0,
+        "errors": tracker.errors,
+        "fanout_failures": int(fanout_failure_count() - failures_before),
+        "delivery_p95": percentile(tracker.delivery, 0.95),
+        "p50": percentile(everything, 0.50),
+        "p95": percentile(everything, 0.95),
+        "p99": percentile(everything, 0.99),
+        "by_kind": {kind: percentile(values, 0.95) for kind, values in tracker.latencies.items()},
+    }
+
+
+def lift_rate_limits():
+    """Снять лимиты Telegram в планировщике, чтобы мерить только сам бот"""
+    huge = 1_000_000.0
+    outbound._global = TokenBucket(huge, huge)
+    outbound.chat_rate = huge
+    outbound.chat_burst = huge
+    outbound.group_rate = huge
+    outbound._chats.clear()
+
+
+async def run(args):
+    request = FakeBotRequest(args.latency / 1000, args.jitter / 1000)
+    bot = ExtBot(token=BOT_TOKEN, request=request, get_updates_request=FakeBotRequest())
+    application = build_application(bot)
+    tracker = UpdateTracker()
+    request.on_notification = tracker.notified
+    application.add_handler(TypeHandler(Update, tracker.finished), group=100)
+    application.add_error_handler(tracker.error)
+    await application.initialize()
+    await application.start()
+    writer = asyncio.create_task(write_behind_loop())
+    if args.unlimited:
+        lift_rate_limits()
+
+    factory = UpdateFactory(bot, request, args.users, args.reply_share, args.callback_share)
+    managers_added = 0
+
+    print(f"Задержка API: {args.latency:g} мс (+до {args.jitter:g}), "
+          f"лимиты Telegram: {'сняты' if args.unlimited else 'как в боте'}\n")
+    print(f"{'менеджеров':>10} {'цель/с':>8} {'факт/с':>8} {'p50 мс':>9} {'p95 мс':>9} "
+          f"{'p99 мс':>9} {'ошибок':>7} {'сбоев':>6} {'доставка':>9}  p95 по видам, мс")
+    try:
+        for managers in sorted(int(value) for value in args.managers.split(",")):
+            while managers_added < managers:
+                await adb.add_manager(MANAGER_BASE_ID + managers_added, f"load_manager_{managers_added}")
+                managers_added += 1
+            factory.managers = managers
+
+            for rate in sorted(float(value) for value in args.rates.split(",")):
+                result = await run_step(application, tracker, factory, rate, args.duration)
+                by_kind = ", ".join(f"{kind} {value * 1000:.1f}" for kind, value in sorted(result["by_kind"].items()))
+                print(f"{managers:>10} {rate:>8g} {result['throughput']:>8.1f} "
+                      f"{result['p50'] * 1000:>9.1f} {result['p95'] * 1000:>9.1f} "
+                      f"{result['p99'] * 1000:>9.1f} {result['errors']:>7} {result['fanout_failures']:>6} "
+                      f"{result['delivery_p95'] * 1000:>9.1f}  {by_kind}")
+                if args.stop_p99 and result["p99"] * 1000 > args.stop_p99:
+                    print(f"{'':>10} p99 выше {args.stop_p99:g} мс - дальше частоту не повышаем")
+                    break
+    finally:
+        await flush_bursts()
+        print(f"\nВызовы Bot API: {dict(request.calls)}")
+        if request.call_latency:
+            print(f"Средняя задержка вызова: {statistics.mean(request.call_latency) * 1000:.1f} мс")
+        writer.cancel()
+        await asyncio.gather(writer, return_exceptions=True)
+        await adb.flush()
+        if adb.flushes:
+            print(f"Отложенная запись: {adb.flushed_rows} строк за {adb.flushes} транзакций "
+                  f"({adb.flushed_rows / adb.flushes:.1f} на транзакцию)")
+        if burst_stats["notifications"]:
+            print(f"Серии: {burst_stats['messages']} сообщений пользователей -> "
+                  f"{burst_stats['notifications']} уведомлений, "
+                  f"сэкономлено {burst_stats['manager_messages_saved']} sendMessage")
+        routes = adb.routes.stats()
+        if routes["hits"] + routes["misses"]:
+            print(f"Индекс ответов: {routes['hit_ratio']:.0%} ответов менеджеров без запроса к БД")
+        await application.stop()
+        await application.shutdown()
+        await outbound.close()
+        await adb.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--managers", default="1,5,20", help="числа менеджеров через запятую")
+    parser.add_argument("--rates", default="25,50,100,200,400", help="апдейтов в секунду через запятую")
+    parser.add_argument("--duration", type=float, default=10, help="секунд на каждую частоту")
+    parser.add_argument("--users", type=int, default=1_000)
+    parser.add_argument("--latency", type=float, default=50, help="задержка одного вызова API, мс")
+    parser.add_argument("--jitter", type=float, default=20, help="случайная добавка к задержке, мс")
+    parser.add_argument("--reply-share", type=float, default=0.2, help="доля ответов менеджеров")
+    parser.add_argument("--callback-share", type=float, default=0.1, help="доля нажатий FAQ-кнопок")
+    parser.add_argument("--unlimited", action="store_true", help="снять лимиты Telegram в планировщике")
+    parser.add_argument("--stop-p99", type=float, default=5_000,
+                        help="прекратить повышать частоту, когда p99 превысит столько мс (0 - не прекращать)")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
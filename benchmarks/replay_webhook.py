@@ -0,0 +1,67 @@
+"""
+Отправка записанных апдейтов на webhook бота.
+
+Файл - JSON Lines: один объект Update (как его присылает Telegram) на
+строку. Апдейты отправляются POST-запросами с заголовком
+X-Telegram-Bot-Api-Secret-Token; печатаются коды ответов и задержка
+приёма. Бот при этом можно направить на fake_bot_api, чтобы ответы
+никуда не уходили.
+
+Запуск из корня репозитория:
+    python benchmarks/fake_bot_api.py --port 8081 &
+    BOT_MODE=webhook WEBHOOK_URL=https://example.org/telegram/webhook WEBHOOK_SECRET=s3cret \\
+        BOT_API_BASE_URL=http://127.0.0.1:8081/bot python main.py &
+    python benchmarks/replay_webhook.py updates.jsonl --secret s3cret --concurrency 20
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+
+import aiohttp
+
+
+async def replay(args):
+    with open(args.path, encoding="utf-8") as file:
+        updates = [json.loads(line) for line in file if line.strip()]
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    statuses = Counter()
+    latencies = []
+
+    async def post(session: aiohttp.ClientSession, update: dict):
+        async with semaphore:
+            started = time.perf_counter()
+            async with session.post(args.url, json=update, headers=headers) as response:
+                await response.read()
+                statuses[response.status] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(post(session, update) for update in updates))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"Апдейтов: {len(updates)} за {elapsed:.2f} с ({len(updates) / elapsed:.0f}/с)")
+    print(f"Коды ответов: {dict(statuses)}")
+    if latencies:
+        print(f"Приём, мс: p50 {latencies[len(latencies) // 2] * 1000:.1f}, "
+              f"p99 {latencies[int(0.99 * (len(latencies) - 1))] * 1000:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="JSON Lines с апдейтами")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/telegram/webhook")
+    parser.add_argument("--secret", default="", help="значение WEBHOOK_SECRET бота")
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(replay(args))
+
+
+if __name__ == "__main__":
+    main()
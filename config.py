@@ -8,13 +8,139 @@ load_dotenv()
 # Токен бота
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 
+# Адрес Bot API (прокси) и HTTP-транспорт: пул keep-alive соединений для отправок,
+# отдельный пул для long polling getUpdates, таймауты в секундах, версия HTTP ("1.1" или "2")
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL", "https://test.pomidorka-i-f.workers.dev/tg/")
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+HTTP_VERSION = os.getenv("HTTP_VERSION", "1.1")
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+HTTP_WRITE_TIMEOUT = float(os.getenv("HTTP_WRITE_TIMEOUT", "15"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "5"))
+GET_UPDATES_POOL_SIZE = int(os.getenv("GET_UPDATES_POOL_SIZE", "1"))
+GET_UPDATES_READ_TIMEOUT = float(os.getenv("GET_UPDATES_READ_TIMEOUT", "30"))
+
+# Получение апдейтов: polling (по умолчанию) или webhook. В режиме webhook Telegram
+# присылает апдейты POST-запросом на WEBHOOK_URL, который должен вести на WEBHOOK_PATH
+# HTTP-сервера бота (тот же, что отвечает на /health, порт HTTP_SERVER_PORT).
+# WEBHOOK_SECRET сверяется с заголовком X-Telegram-Bot-Api-Secret-Token (пусто - случайный при старте)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+HTTP_SERVER_PORT = int(os.getenv("HTTP_SERVER_PORT", "8080"))
+
 # Начальные менеджеры (username без @)
 INITIAL_MANAGERS_STR = os.getenv("INITIAL_MANAGERS")
-print(INITIAL_MANAGERS_STR, BOT_TOKEN)
 INITIAL_MANAGERS = [m.strip() for m in INITIAL_MANAGERS_STR.split(",")]
 
 # База данных
-DATABASE_NAME = "managers.db"
+DATABASE_NAME = os.getenv("DATABASE_NAME", "managers.db")
+
+# Пул соединений SQLite и настройки PRAGMA
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "5"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "8192"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(64 * 1024 * 1024)))
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "128"))
+
+# Кэш списка менеджеров: период принудительного перечитывания из БД в секундах (0 - не перечитывать)
+MANAGER_CACHE_TTL = float(os.getenv("MANAGER_CACHE_TTL", "0"))
+
+# Кэш состояния пользователей (первое сообщение, ответил ли менеджер): сколько пользователей
+# держать в памяти
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+
+# Индекс ответов менеджеров в памяти: (чат менеджера, сообщение) -> пользователь для недавних
+# уведомлений. Ограничен числом записей и возрастом (в часах); более старые ищутся в БД
+REPLY_INDEX_SIZE = int(os.getenv("REPLY_INDEX_SIZE", "100000"))
+REPLY_INDEX_TTL_HOURS = float(os.getenv("REPLY_INDEX_TTL_HOURS", "24"))
+
+# Темы пользователей в группе менеджеров в памяти (в обе стороны): сколько пользователей
+# держать; остальные читаются из БД
+TOPIC_CACHE_SIZE = int(os.getenv("TOPIC_CACHE_SIZE", "50000"))
+
+# Отложенная запись: связи сообщений и состояния пользователей копятся в памяти и пишутся
+# одной транзакцией раз в WRITE_BEHIND_INTERVAL секунд или сразу при WRITE_BEHIND_MAX_ROWS строк
+WRITE_BEHIND_INTERVAL = float(os.getenv("WRITE_BEHIND_INTERVAL", "0.05"))
+WRITE_BEHIND_MAX_ROWS = int(os.getenv("WRITE_BEHIND_MAX_ROWS", "200"))
+
+# Обслуживание БД: связи сообщений старше MAPPING_RETENTION_DAYS переносятся в архивный файл
+# (0 - не архивировать), затем место освобождается incremental_vacuum небольшими порциями
+MAPPING_RETENTION_DAYS = float(os.getenv("MAPPING_RETENTION_DAYS", "30"))
+MAPPING_ARCHIVE_NAME = os.getenv("MAPPING_ARCHIVE_NAME", "managers_archive.db")
+DB_MAINTENANCE_INTERVAL = float(os.getenv("DB_MAINTENANCE_INTERVAL", "3600"))
+DB_MAINTENANCE_BATCH = int(os.getenv("DB_MAINTENANCE_BATCH", "1000"))
+DB_VACUUM_PAGES = int(os.getenv("DB_VACUUM_PAGES", "256"))
+DB_MAINTENANCE_PAUSE = float(os.getenv("DB_MAINTENANCE_PAUSE", "0.05"))
+
+# Рассылка менеджерам: сколько отправок одновременно и таймаут одного вызова API в секундах
+# (время ожидания лимита в очереди планировщика не считается)
+FANOUT_CONCURRENCY = int(os.getenv("FANOUT_CONCURRENCY", "10"))
+FANOUT_SEND_TIMEOUT = float(os.getenv("FANOUT_SEND_TIMEOUT", "15"))
+
+# Сколько апдейтов обрабатывать одновременно (0 - строго по одному): обработчик, ждущий
+# лимита чата в планировщике, не задерживает апдейты других пользователей. Апдейты одного
+# пользователя в одном чате всё равно идут по очереди (update_processor.py)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+
+# Общая группа менеджеров с темами (форум): если задан ID супергруппы, сообщения каждого
+# пользователя идут один раз в его тему, а не каждому менеджеру в личку. Бот должен быть
+# администратором группы с правом управлять темами. Telegram ограничивает бота ~20 сообщениями
+# в минуту на группу (OUTBOUND_GROUP_PER_MINUTE), серии сообщений (USER_BURST_WINDOW) здесь особенно полезны:
+# пока уведомление ждёт лимита группы, новые сообщения пользователя добавляются в него
+MANAGER_GROUP_ID = int(os.getenv("MANAGER_GROUP_ID", "0"))
+
+# Серия сообщений пользователя за USER_BURST_WINDOW секунд уходит менеджерам одним
+# уведомлением (0 - пересылать каждое сообщение сразу). Текст серии ограничен
+# USER_BURST_MAX_CHARS символами, при превышении уведомление отправляется досрочно
+USER_BURST_WINDOW = float(os.getenv("USER_BURST_WINDOW", "2"))
+USER_BURST_MAX_CHARS = int(os.getenv("USER_BURST_MAX_CHARS", "3500"))
+
+# Лимиты исходящих сообщений Telegram: глобально в секунду, на личный чат (в секунду и запас),
+# на группу в минуту; одновременных запросов к API и повторов после RetryAfter
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_CHAT_BURST = float(os.getenv("OUTBOUND_CHAT_BURST", "3"))
+OUTBOUND_GROUP_PER_MINUTE = float(os.getenv("OUTBOUND_GROUP_PER_MINUTE", "20"))
+OUTBOUND_MAX_IN_FLIGHT = int(os.getenv("OUTBOUND_MAX_IN_FLIGHT", "20"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+
+# Автоответы в обычных сообщениях пользователей (по умолчанию выключены): при балле
+# не ниже порога бот сразу отвечает текстом FAQ. Режим skip - менеджерам ничего не отправляется,
+# digest - раз в AUTO_REPLY_DIGEST_INTERVAL секунд менеджерам приходит одна сводка
+AUTO_REPLY_DEFLECTION = os.getenv("AUTO_REPLY_DEFLECTION", "0").lower() in ("1", "true", "yes")
+AUTO_REPLY_DEFLECTION_THRESHOLD = float(os.getenv("AUTO_REPLY_DEFLECTION_THRESHOLD", "90"))
+AUTO_REPLY_DEFLECTION_MODE = os.getenv("AUTO_REPLY_DEFLECTION_MODE", "digest")
+AUTO_REPLY_DIGEST_INTERVAL = float(os.getenv("AUTO_REPLY_DIGEST_INTERVAL", "3600"))
+
+# Нечёткий поиск автоответов с учётом опечаток ("стоимасть", "карпоратив")
+AUTO_REPLY_FUZZY = os.getenv("AUTO_REPLY_FUZZY", "1").lower() in ("1", "true", "yes")
+
+# Сколько последних результатов поиска автоответа хранить в LRU-кэше (0 - без кэша)
+AUTO_REPLY_CACHE_SIZE = int(os.getenv("AUTO_REPLY_CACHE_SIZE", "2048"))
+
+# Выборочное профилирование обработчиков: доля профилируемых апдейтов (0 - выключено,
+# меняется на лету командой /profile), куда писать файлы и включать ли cProfile
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_DIR = os.getenv("PROFILING_DIR", "profiles")
+PROFILING_CPROFILE = os.getenv("PROFILING_CPROFILE", "1").lower() in ("1", "true", "yes")
+
+# Сторож event loop: период замера задержки, порог блокировки для записи стека в лог,
+# и задержка (максимум за LOOP_LAG_WINDOW секунд), при которой /health отвечает 503
+LOOP_WATCHDOG_INTERVAL = float(os.getenv("LOOP_WATCHDOG_INTERVAL", "0.1"))
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD", "0.5"))
+LOOP_LAG_UNHEALTHY = float(os.getenv("LOOP_LAG_UNHEALTHY", "2"))
+LOOP_LAG_WINDOW = float(os.getenv("LOOP_LAG_WINDOW", "30"))
+
+# Логирование: уровень, формат (json или text), размер очереди перед потоком вывода
+# и подавление одинаковых предупреждений/ошибок (не больше BURST за WINDOW секунд)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_RATE_LIMIT_WINDOW = float(os.getenv("LOG_RATE_LIMIT_WINDOW", "60"))
+LOG_RATE_LIMIT_BURST = int(os.getenv("LOG_RATE_LIMIT_BURST", "5"))
 
 # Приветственное сообщение
 WELCOME_MESSAGE = """Рады вас приветствовать, {first_name}!  👋
@@ -163,7 +289,12 @@ MANAGER_COMMANDS = """🔧 <b>Команды менеджера:</b>
 
 💬 <b>Ответ пользователю:</b>
 Просто ответьте (Reply) на его сообщение
+или напишите в его тему в группе менеджеров
 
 🧪 <b>Тестирование автоответов:</b>
 /test_auto сообщение - Проверить автоответ
-/menu - Показать главное меню"""
\ No newline at end of file
+/menu - Показать главное меню
+
+📊 <b>Статистика:</b>
+/stats - Очередь сообщений и автоответы
+/profile on 0.1 | off | dump | reset - Профилирование обработчиков"""
\ No newline at end of file
@@ -2,25 +2,149 @@
 Модуль для работы с базой данных
 """
 
+import asyncio
+import functools
+import logging
+import os
+import queue
 import sqlite3
-from typing import List, Optional
-from config import DATABASE_NAME, INITIAL_MANAGERS
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+from config import (
+    DATABASE_NAME,
+    INITIAL_MANAGERS,
+    DB_POOL_SIZE,
+    DB_BUSY_TIMEOUT,
+    DB_CACHE_SIZE_KB,
+    DB_MMAP_SIZE,
+    DB_STATEMENT_CACHE,
+    MANAGER_CACHE_TTL,
+    USER_CACHE_SIZE,
+    REPLY_INDEX_SIZE,
+    REPLY_INDEX_TTL_HOURS,
+    TOPIC_CACHE_SIZE,
+    WRITE_BEHIND_MAX_ROWS,
+    MAPPING_ARCHIVE_NAME,
+    DB_MAINTENANCE_PAUSE,
+)
+from metrics import db_query_latency
+from profiling import section, SECTION_DB
+
+logger = logging.getLogger(__name__)
+
+
+# Миграции схемы по порядку. PRAGMA user_version хранит число применённых,
+# поэтому существующие файлы managers.db обновляются на месте при старте.
+MIGRATIONS = [
+    # 1: покрывающий индекс для поиска пользователя по ответу менеджера
+    (
+        "CREATE INDEX IF NOT EXISTS idx_message_mapping_lookup "
+        "ON message_mapping (manager_chat_id, manager_message_id, user_id)",
+    ),
+    # 2: темы пользователей в группе менеджеров (режим MANAGER_GROUP_ID)
+    (
+        "CREATE TABLE IF NOT EXISTS user_topics ("
+        "chat_id INTEGER NOT NULL, "
+        "user_id INTEGER NOT NULL, "
+        "thread_id INTEGER NOT NULL, "
+        "created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, "
+        "PRIMARY KEY (chat_id, user_id))",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_user_topics_thread ON user_topics (chat_id, thread_id)",
+    ),
+]
 
 
 class Database:
     """Класс для работы с базой данных менеджеров и пользователей"""
 
-    def __init__(self, db_name: str = DATABASE_NAME):
+    def __init__(self, db_name: str = DATABASE_NAME, pool_size: int = DB_POOL_SIZE):
         self.db_name = db_name
+        self.pool_size = max(1, pool_size)
+        self._pool = queue.LifoQueue(maxsize=self.pool_size)
+        self._pool_lock = threading.Lock()
+        self._connections_created = 0
+
+        # Кэш менеджеров в памяти процесса: id -> username
+        self.roster_ttl = MANAGER_CACHE_TTL
+        self._roster_lock = threading.Lock()
+        self._manager_names = {}
+        self._manager_ids = frozenset()
+        self._roster_loaded_at = None
+
         self.init_db()
 
+    def _connect(self) -> sqlite3.Connection:
+        """Открыть новое долгоживущее соединение с настроенными PRAGMA"""
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=DB_BUSY_TIMEOUT,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE,
+        )
+        conn.execute("PRAGMA journal_mode = WAL")
+        # В режиме WAL NORMAL безопасен: fsync только на checkpoint
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = -{DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {DB_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        """Взять соединение из пула (создаётся лениво, не больше pool_size)"""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            with self._pool_lock:
+                can_create = self._connections_created < self.pool_size
+                if can_create:
+                    self._connections_created += 1
+            if can_create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._pool_lock:
+                        self._connections_created -= 1
+                    raise
+            else:
+                conn = self._pool.get()
+
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    @contextmanager
+    def _transaction(self):
+        """Соединение из пула внутри транзакции (commit/rollback автоматически)"""
+        with self._connection() as conn:
+            with conn:
+                yield conn
+
+    def close(self):
+        """Закрыть все соединения пула"""
+        with self._pool_lock:
+            while True:
+                try:
+                    conn = self._pool.get_nowait()
+                except queue.Empty:
+                    break
+                conn.close()
+                self._connections_created -= 1
+
     def init_db(self):
         """Инициализация базы данных"""
-        with sqlite3.connect(self.db_name) as conn:
+        self._enable_incremental_vacuum()
+
+        with self._transaction() as conn:
             cursor = conn.cursor()
 
             # Таблица менеджеров
-            cursor. execute("""
+            cursor.execute("""
                 CREATE TABLE IF NOT EXISTS managers (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id INTEGER UNIQUE NOT NULL,
@@ -40,7 +164,7 @@ class Database:
                 )
             """)
 
-            # Таблица польз��вателей
+            # Таблица пользователей
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS users (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -51,101 +175,650 @@ class Database:
                 )
             """)
 
-            conn.commit()
+        self.migrate()
+
+    def _enable_incremental_vacuum(self):
+        """Включить auto_vacuum = INCREMENTAL (для существующего файла нужен разовый VACUUM)"""
+        with self._connection() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                return
+            has_tables = conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone() is not None
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            if has_tables:
+                logger.info("Перестройка %s для incremental_vacuum (однократно)", self.db_name)
+                conn.execute("VACUUM")
+
+    def migrate(self):
+        """Применить недостающие миграции схемы, каждую в своей транзакции"""
+        with self._connection() as conn:
+            while True:
+                # Версию читаем под блокировкой записи: второй процесс не применит миграцию повторно
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    version = conn.execute("PRAGMA user_version").fetchone()[0]
+                    if version >= len(MIGRATIONS):
+                        conn.commit()
+                        return
+                    for statement in MIGRATIONS[version]:
+                        conn.execute(statement)
+                    conn.execute(f"PRAGMA user_version = {version + 1}")
+                except Exception:
+                    conn.rollback()
+                    raise
+                conn.commit()
+
+    def load_managers(self) -> List[tuple]:
+        """Перечитать список менеджеров из БД в кэш"""
+        with self._connection() as conn:
+            rows = conn.execute("SELECT user_id, username FROM managers").fetchall()
+
+        with self._roster_lock:
+            self._set_roster(dict(rows))
+        return rows
+
+    def _set_roster(self, names: dict):
+        """Заменить кэш менеджеров целиком (вызывать под _roster_lock)"""
+        self._manager_names = names
+        self._manager_ids = frozenset(names)
+        self._roster_loaded_at = time.monotonic()
+
+    def is_roster_fresh(self) -> bool:
+        """Можно ли отвечать на вопросы о менеджерах из кэша без SQL"""
+        if self._roster_loaded_at is None:
+            return False
+        if self.roster_ttl <= 0:
+            return True
+        return time.monotonic() - self._roster_loaded_at < self.roster_ttl
 
     def add_manager(self, user_id: int, username: str) -> bool:
         """Добавить менеджера"""
         try:
-            with sqlite3.connect(self.db_name) as conn:
-                cursor = conn. cursor()
-                cursor.execute(
+            with self._transaction() as conn:
+                conn.execute(
                     "INSERT INTO managers (user_id, username) VALUES (?, ?)",
                     (user_id, username)
                 )
-                conn.commit()
-                return True
         except sqlite3.IntegrityError:
             return False
 
+        with self._roster_lock:
+            if self._roster_loaded_at is not None:
+                self._set_roster({**self._manager_names, user_id: username})
+        return True
+
     def remove_manager(self, username: str) -> bool:
         """Удалить менеджера"""
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM managers WHERE username = ?", (username,))
-            conn.commit()
-            return cursor.rowcount > 0
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM managers WHERE username = ?", (username,))
+            removed = cursor.rowcount > 0
+
+        if removed:
+            with self._roster_lock:
+                if self._roster_loaded_at is not None:
+                    self._set_roster({
+                        manager_id: name
+                        for manager_id, name in self._manager_names.items()
+                        if name != username
+                    })
+        return removed
 
     def is_manager(self, user_id: int) -> bool:
         """Проверить, является ли пользователь менеджером"""
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT 1 FROM managers WHERE user_id = ?", (user_id,))
-            return cursor.fetchone() is not None
+        if not self.is_roster_fresh():
+            self.load_managers()
+        return user_id in self._manager_ids
 
     def get_all_managers(self) -> List[tuple]:
         """Получить всех менеджеров"""
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT user_id, username FROM managers")
-            return cursor.fetchall()
+        if not self.is_roster_fresh():
+            return self.load_managers()
+        return list(self._manager_names.items())
 
-    def save_message_mapping(self, manager_message_id: int, user_id: int, manager_chat_id: int):
-        """Сохранить связь сообщения менеджера с пользователем"""
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "INSERT INTO message_mapping (manager_message_id, user_id, manager_chat_id) VALUES (?, ?, ?)",
-                (manager_message_id, user_id, manager_chat_id)
-            )
-            conn.commit()
+    def archive_old_mappings(self, max_age_days: float, batch_size: int,
+                             archive_name: str = MAPPING_ARCHIVE_NAME) -> int:
+        """
+        Перенести одну порцию связей старше max_age_days в архивный файл.
+        Возвращает число перенесённых строк (меньше batch_size - старых больше нет).
+        """
+        age = f"-{max_age_days} days"
+        with self._connection() as conn:
+            conn.execute("ATTACH DATABASE ? AS archive", (archive_name,))
+            try:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS archive.message_mapping (
+                        id INTEGER PRIMARY KEY,
+                        manager_message_id INTEGER NOT NULL,
+                        user_id INTEGER NOT NULL,
+                        manager_chat_id INTEGER NOT NULL,
+                        created_at TIMESTAMP
+                    )
+                """)
+                # Индекс для ответов менеджеров на архивные уведомления (get_user_by_message)
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS archive.idx_message_mapping_lookup "
+                    "ON message_mapping (manager_chat_id, manager_message_id, user_id)"
+                )
+                with conn:
+                    # Старые строки лежат в начале по rowid, поэтому выборка не сканирует всю таблицу
+                    last_id = conn.execute(
+                        "SELECT MAX(id) FROM ("
+                        "SELECT id FROM main.message_mapping "
+                        "WHERE created_at < datetime('now', ?) ORDER BY id LIMIT ?)",
+                        (age, batch_size)
+                    ).fetchone()[0]
+                    if last_id is None:
+                        return 0
 
-    def get_user_by_message(self, manager_message_id:  int, manager_chat_id: int) -> Optional[int]:
-        """Получить ID пользователя по сообщению менеджера"""
-        with sqlite3.connect(self. db_name) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT user_id FROM message_mapping WHERE manager_message_id = ?  AND manager_chat_id = ? ",
+                    conn.execute(
+                        "INSERT OR IGNORE INTO archive.message_mapping "
+                        "SELECT id, manager_message_id, user_id, manager_chat_id, created_at "
+                        "FROM main.message_mapping WHERE id <= ? AND created_at < datetime('now', ?)",
+                        (last_id, age)
+                    )
+                    cursor = conn.execute(
+                        "DELETE FROM main.message_mapping WHERE id <= ? AND created_at < datetime('now', ?)",
+                        (last_id, age)
+                    )
+                    return cursor.rowcount
+            finally:
+                conn.execute("DETACH DATABASE archive")
+
+    def incremental_vacuum(self, pages: int) -> int:
+        """Вернуть ОС до pages свободных страниц, результат - сколько свободных осталось"""
+        with self._connection() as conn:
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+            return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    def get_user_by_message(self, manager_message_id: int, manager_chat_id: int,
+                            archive_name: str = MAPPING_ARCHIVE_NAME) -> Optional[int]:
+        """Получить ID пользователя по сообщению менеджера (старые связи ищутся в архиве)"""
+        with self._connection() as conn:
+            result = conn.execute(
+                "SELECT user_id FROM message_mapping WHERE manager_message_id = ? AND manager_chat_id = ?",
                 (manager_message_id, manager_chat_id)
-            )
-            result = cursor.fetchone()
-            return result[0] if result else None
+            ).fetchone()
+        if result:
+            return result[0]
+        return self._get_archived_user_by_message(manager_message_id, manager_chat_id, archive_name)
 
-    def is_first_message(self, user_id: int) -> bool:
-        """Проверить, первое ли это сообщение от пользователя"""
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT first_message_sent FROM users WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
+    def _get_archived_user_by_message(self, manager_message_id: int, manager_chat_id: int,
+                                      archive_name: str) -> Optional[int]:
+        """Поиск в архивном файле; промахи редки, поэтому соединение открывается на один запрос"""
+        if not os.path.exists(archive_name):
+            return None
+        conn = sqlite3.connect(f"file:{archive_name}?mode=ro", uri=True, timeout=DB_BUSY_TIMEOUT)
+        try:
+            result = conn.execute(
+                "SELECT user_id FROM message_mapping WHERE manager_chat_id = ? AND manager_message_id = ?",
+                (manager_chat_id, manager_message_id)
+            ).fetchone()
+        except sqlite3.OperationalError:
+            # Архив ещё не создан обслуживанием (нет таблицы)
+            return None
+        finally:
+            conn.close()
+        return result[0] if result else None
 
-            if result is None:
-                # Пользователь новый - добавляем его
-                cursor.execute("INSERT INTO users (user_id, first_message_sent) VALUES (?, 1)", (user_id,))
-                conn.commit()
-                return True
-            else:
-                # Пользователь уже писал
-                return False
+    def get_user_topic(self, chat_id: int, user_id: int) -> Optional[int]:
+        """ID темы пользователя в группе менеджеров"""
+        with self._connection() as conn:
+            result = conn.execute(
+                "SELECT thread_id FROM user_topics WHERE chat_id = ? AND user_id = ?", (chat_id, user_id)
+            ).fetchone()
+            return result[0] if result else None
 
-    def has_manager_replied(self, user_id: int) -> bool:
-        """Проверить, отвечал ли менеджер этому пользователю"""
-        with sqlite3.connect(self. db_name) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT manager_replied FROM users WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
-            return result[0] == 1 if result else False
+    def get_user_by_topic(self, chat_id: int, thread_id: int) -> Optional[int]:
+        """Пользователь, которому принадлежит тема группы менеджеров"""
+        with self._connection() as conn:
+            result = conn.execute(
+                "SELECT user_id FROM user_topics WHERE chat_id = ? AND thread_id = ?", (chat_id, thread_id)
+            ).fetchone()
+            return result[0] if result else None
 
-    def set_manager_replied(self, user_id: int):
-        """Отметить что менеджер ответил пользователю"""
-        with sqlite3.connect(self.db_name) as conn:
-            cursor = conn.cursor()
-            # Если пользователя нет - создаём
-            cursor.execute(
-                "INSERT INTO users (user_id, manager_replied) VALUES (?, 1) "
-                "ON CONFLICT(user_id) DO UPDATE SET manager_replied = 1",
-                (user_id,)
+    def save_user_topic(self, chat_id: int, user_id: int, thread_id: int):
+        """Запомнить тему пользователя (новая тема заменяет удалённую)"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM user_topics WHERE chat_id = ? AND thread_id = ?", (chat_id, thread_id))
+            conn.execute(
+                "INSERT OR REPLACE INTO user_topics (chat_id, user_id, thread_id) VALUES (?, ?, ?)",
+                (chat_id, user_id, thread_id)
             )
-            conn.commit()
+
+    def load_user_state(self, user_id: int) -> Optional[Tuple[bool, bool]]:
+        """(первое сообщение уже было, менеджер ответил) или None для нового пользователя"""
+        with self._connection() as conn:
+            result = conn.execute(
+                "SELECT first_message_sent, manager_replied FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            return (result[0] == 1, result[1] == 1) if result else None
+
+    def write_batch(self, mappings: List[Tuple[int, int, int]], states: List[Tuple[int, bool, bool]]):
+        """Связи сообщений и состояния пользователей из журнала отложенной записи - одной транзакцией"""
+        with self._transaction() as conn:
+            if mappings:
+                conn.executemany(
+                    "INSERT INTO message_mapping (manager_message_id, user_id, manager_chat_id) VALUES (?, ?, ?)",
+                    mappings
+                )
+            if states:
+                conn.executemany(
+                    "INSERT INTO users (user_id, first_message_sent, manager_replied) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET "
+                    "first_message_sent = max(first_message_sent, excluded.first_message_sent), "
+                    "manager_replied = max(manager_replied, excluded.manager_replied)",
+                    [(user_id, int(first), int(replied)) for user_id, first, replied in states]
+                )
+
+
+class UserStateCache:
+    """
+    Состояние пользователей в памяти: user_id -> [первое сообщение было, менеджер ответил].
+    Изменения помечаются грязными и пишутся в БД пачкой (write-behind).
+    Используется только из потока event loop, поэтому без блокировок.
+    """
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE):
+        self.maxsize = max(1, maxsize)
+        self._states: "OrderedDict[int, list]" = OrderedDict()
+        self._dirty = set()
+        # Грязные записи, вытесненные из кэша до сброса в БД
+        self._evicted: Dict[int, list] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> Optional[list]:
+        state = self._states.get(user_id)
+        if state is None:
+            state = self._evicted.get(user_id)
+            if state is None:
+                self.misses += 1
+                return None
+            self._put(user_id, state)
+        self._states.move_to_end(user_id)
+        self.hits += 1
+        return state
+
+    def peek(self, user_id: int) -> Optional[list]:
+        """Состояние без учёта в статистике и без изменения порядка вытеснения"""
+        state = self._states.get(user_id)
+        return state if state is not None else self._evicted.get(user_id)
+
+    def _put(self, user_id: int, state: list):
+        self._states[user_id] = state
+        self._states.move_to_end(user_id)
+        if len(self._states) > self.maxsize:
+            old_id, old_state = self._states.popitem(last=False)
+            if old_id in self._dirty:
+                self._dirty.discard(old_id)
+                self._evicted[old_id] = old_state
+
+    def load(self, user_id: int, first_sent: bool, replied: bool) -> list:
+        """Положить состояние, прочитанное из БД (чистое)"""
+        state = [first_sent, replied]
+        self._put(user_id, state)
+        return state
+
+    def update(self, user_id: int, first_sent: bool = False, replied: bool = False) -> list:
+        """Включить флаги и пометить пользователя грязным"""
+        state = self._states.get(user_id) or self._evicted.pop(user_id, None) or [False, False]
+        state[0] = state[0] or first_sent
+        state[1] = state[1] or replied
+        self._put(user_id, state)
+        self._evicted.pop(user_id, None)
+        self._dirty.add(user_id)
+        return state
+
+    def take_dirty(self) -> List[Tuple[int, bool, bool]]:
+        """Забрать грязные записи для сброса (флаги снимаются сразу)"""
+        rows = [(user_id, state[0], state[1]) for user_id, state in self._evicted.items()]
+        rows.extend(
+            (user_id, self._states[user_id][0], self._states[user_id][1])
+            for user_id in self._dirty
+        )
+        self._evicted.clear()
+        self._dirty.clear()
+        return rows
+
+    def restore_dirty(self, rows: List[Tuple[int, bool, bool]]):
+        """Вернуть записи в грязные после неудачного сброса"""
+        for user_id, first_sent, replied in rows:
+            self.update(user_id, first_sent, replied)
+
+    @property
+    def dirty_count(self) -> int:
+        return len(self._dirty) + len(self._evicted)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._states),
+            "maxsize": self.maxsize,
+            "dirty": self.dirty_count,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+class ReplyRouteIndex:
+    """
+    Недавние уведомления менеджерам: (manager_chat_id, manager_message_id) -> user_id.
+    Записи идут в порядке отправки, поэтому лишние и устаревшие срезаются с начала.
+    Используется только из потока event loop.
+    """
+
+    def __init__(self, maxsize: int = REPLY_INDEX_SIZE, max_age: float = REPLY_INDEX_TTL_HOURS * 3600):
+        self.maxsize = maxsize
+        self.max_age = max_age
+        self._routes: "OrderedDict[Tuple[int, int], Tuple[int, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, manager_chat_id: int, manager_message_id: int, user_id: int):
+        if self.maxsize <= 0:
+            return
+        now = time.monotonic()
+        key = (manager_chat_id, manager_message_id)
+        self._routes.pop(key, None)
+        self._routes[key] = (user_id, now)
+        self._prune(now)
+
+    def _prune(self, now: float):
+        while len(self._routes) > self.maxsize:
+            self._routes.popitem(last=False)
+        while self._routes:
+            _, added = next(iter(self._routes.values()))
+            if now - added < self.max_age:
+                break
+            self._routes.popitem(last=False)
+
+    def get(self, manager_chat_id: int, manager_message_id: int) -> Optional[int]:
+        route = self._routes.get((manager_chat_id, manager_message_id))
+        if route is None or time.monotonic() - route[1] >= self.max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return route[0]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._routes),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+class TopicCache:
+    """
+    Темы группы менеджеров: (чат, пользователь) -> тема и обратно, не больше maxsize
+    пользователей; давно не писавшие вытесняются и при следующем обращении читаются из БД.
+    Используется только из потока event loop.
+    """
+
+    def __init__(self, maxsize: int = TOPIC_CACHE_SIZE):
+        self.maxsize = max(1, maxsize)
+        self._threads: "OrderedDict[Tuple[int, int], int]" = OrderedDict()
+        self._users: Dict[Tuple[int, int], int] = {}
+
+    def thread(self, chat_id: int, user_id: int) -> Optional[int]:
+        thread_id = self._threads.get((chat_id, user_id))
+        if thread_id is not None:
+            self._threads.move_to_end((chat_id, user_id))
+        return thread_id
+
+    def user(self, chat_id: int, thread_id: int) -> Optional[int]:
+        user_id = self._users.get((chat_id, thread_id))
+        if user_id is not None:
+            self._threads.move_to_end((chat_id, user_id))
+        return user_id
+
+    def remember(self, chat_id: int, user_id: int, thread_id: int):
+        """Запомнить тему пользователя; прежняя тема пользователя и прежний владелец темы забываются"""
+        old_thread_id = self._threads.pop((chat_id, user_id), None)
+        if old_thread_id is not None:
+            self._users.pop((chat_id, old_thread_id), None)
+        old_user_id = self._users.get((chat_id, thread_id))
+        if old_user_id is not None:
+            self._threads.pop((chat_id, old_user_id), None)
+
+        self._threads[(chat_id, user_id)] = thread_id
+        self._users[(chat_id, thread_id)] = user_id
+        if len(self._threads) > self.maxsize:
+            (old_chat_id, _), old_thread_id = self._threads.popitem(last=False)
+            del self._users[(old_chat_id, old_thread_id)]
+
+    def __len__(self) -> int:
+        return len(self._threads)
+
+
+class AsyncDatabase:
+    """
+    Неблокирующая обёртка над Database для async-обработчиков.
+    Каждый запрос выполняется в отдельном пуле потоков, event loop не ждёт SQLite.
+
+    Записи горячего пути (связи сообщений, состояния пользователей) не ждут БД:
+    они копятся в журнале и пишутся пачкой методом flush(). Чтение связей
+    видит ещё не записанные строки.
+    """
+
+    def __init__(self, database: Database, max_workers: int = DB_POOL_SIZE):
+        self.database = database
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, max_workers),
+            thread_name_prefix="db"
+        )
+        self.users = UserStateCache()
+        self.routes = ReplyRouteIndex()
+        # Темы группы менеджеров: (чат, пользователь) -> тема и обратно
+        self.topics = TopicCache()
+        # Журнал отложенной записи: связи в порядке поступления и индекс для чтения
+        self._pending_mappings: List[Tuple[int, int, int]] = []
+        self._pending_index: Dict[Tuple[int, int], int] = {}
+        self._writes = set()
+        self._wakeup = asyncio.Event()
+        self.max_pending = WRITE_BEHIND_MAX_ROWS
+        self.flushes = 0
+        self.flushed_rows = 0
+
+    async def _run(self, func, *args):
+        """Выполнить синхронный метод Database в потоке БД"""
+        loop = asyncio.get_running_loop()
+        with section(SECTION_DB, func.__name__):
+            return await loop.run_in_executor(self._executor, functools.partial(self._timed, func, *args))
+
+    @staticmethod
+    def _timed(func, *args):
+        """Вызов в потоке БД с замером чистого времени SQLite (без ожидания в очереди пула)"""
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            db_query_latency.observe(time.perf_counter() - started, func.__name__)
+
+    async def load_managers(self) -> List[tuple]:
+        return await self._run(self.database.load_managers)
+
+    async def add_manager(self, user_id: int, username: str) -> bool:
+        return await self._run(self.database.add_manager, user_id, username)
+
+    async def remove_manager(self, username: str) -> bool:
+        return await self._run(self.database.remove_manager, username)
+
+    async def is_manager(self, user_id: int) -> bool:
+        # Свежий кэш отвечает сразу, без перехода в поток БД
+        if self.database.is_roster_fresh():
+            return self.database.is_manager(user_id)
+        return await self._run(self.database.is_manager, user_id)
+
+    async def get_all_managers(self) -> List[tuple]:
+        if self.database.is_roster_fresh():
+            return self.database.get_all_managers()
+        return await self._run(self.database.get_all_managers)
+
+    async def save_message_mapping(self, manager_message_id: int, user_id: int, manager_chat_id: int):
+        await self.save_message_mappings([(manager_message_id, user_id, manager_chat_id)])
+
+    async def save_message_mappings(self, mappings: List[Tuple[int, int, int]]):
+        """Положить связи в журнал; в БД они попадут при ближайшем flush()"""
+        for manager_message_id, user_id, manager_chat_id in mappings:
+            self._pending_index[(manager_chat_id, manager_message_id)] = user_id
+            self.routes.add(manager_chat_id, manager_message_id, user_id)
+        self._pending_mappings.extend(mappings)
+        self._journal_grew()
+
+    async def get_user_by_message(self, manager_message_id: int, manager_chat_id: int) -> Optional[int]:
+        """Недавние уведомления - из индекса в памяти, старые - из SQLite"""
+        user_id = self.routes.get(manager_chat_id, manager_message_id)
+        if user_id is None:
+            user_id = self._pending_index.get((manager_chat_id, manager_message_id))
+        if user_id is not None:
+            return user_id
+        return await self._run(self.database.get_user_by_message, manager_message_id, manager_chat_id)
+
+    async def get_user_topic(self, chat_id: int, user_id: int) -> Optional[int]:
+        thread_id = self.topics.thread(chat_id, user_id)
+        if thread_id is None:
+            thread_id = await self._run(self.database.get_user_topic, chat_id, user_id)
+            if thread_id is not None:
+                self.topics.remember(chat_id, user_id, thread_id)
+        return thread_id
+
+    async def get_user_by_topic(self, chat_id: int, thread_id: int) -> Optional[int]:
+        user_id = self.topics.user(chat_id, thread_id)
+        if user_id is None:
+            user_id = await self._run(self.database.get_user_by_topic, chat_id, thread_id)
+            if user_id is not None:
+                self.topics.remember(chat_id, user_id, thread_id)
+        return user_id
+
+    async def save_user_topic(self, chat_id: int, user_id: int, thread_id: int):
+        # Тема создаётся один раз на пользователя - пишем сразу, мимо журнала
+        await self._run(self.database.save_user_topic, chat_id, user_id, thread_id)
+        self.topics.remember(chat_id, user_id, thread_id)
+
+    async def _user_state(self, user_id: int) -> list:
+        """
+        Состояние пользователя [первое сообщение было, менеджер ответил]: из кэша,
+        при промахе - из БД. Неизвестный пользователь - [False, False] (в кэш не кладётся).
+        """
+        state = self.users.get(user_id)
+        if state is None:
+            loaded = await self._run(self.database.load_user_state, user_id)
+            # Пока ждали БД, другое сообщение того же пользователя могло заполнить кэш
+            state = self.users.peek(user_id)
+            if state is None:
+                state = self.users.load(user_id, *loaded) if loaded else [False, False]
+        return state
+
+    async def is_first_message(self, user_id: int) -> bool:
+        """
+        Отметить, что сообщение пользователя ушло менеджерам; True - если это первое такое.
+        Знакомый пользователь обслуживается из памяти без SQL; новый записывается
+        в БД при следующем сбросе журнала.
+        """
+        state = await self._user_state(user_id)
+        if state[0]:
+            return False
+        self.users.update(user_id, first_sent=True, replied=state[1])
+        self._journal_grew()
+        return True
+
+    async def has_manager_replied(self, user_id: int) -> bool:
+        state = await self._user_state(user_id)
+        return state[1]
+
+    async def set_manager_replied(self, user_id: int):
+        # Сначала читаем состояние из БД: иначе в кэше окажется «первого сообщения не было»
+        # и следующее сообщение давнего пользователя сочтётся первым
+        state = await self._user_state(user_id)
+        self.users.update(user_id, first_sent=state[0], replied=True)
+        self._journal_grew()
+
+    def _journal_grew(self):
+        """Разбудить запись, не дожидаясь интервала, если журнал набрал max_pending строк"""
+        if len(self._pending_mappings) + self.users.dirty_count >= self.max_pending:
+            self._wakeup.set()
+
+    @property
+    def pending_writes(self) -> int:
+        return len(self._pending_mappings) + self.users.dirty_count
+
+    async def wait_for_writes(self, timeout: float):
+        """Дождаться интервала записи или переполнения журнала"""
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def flush(self) -> int:
+        """
+        Записать журнал (связи и изменённые состояния) одной транзакцией; возвращает число строк.
+        Запись доводится до конца, даже если ожидающую задачу отменили при остановке.
+        """
+        mappings, self._pending_mappings = self._pending_mappings, []
+        states = self.users.take_dirty()
+        if not mappings and not states:
+            return 0
+
+        write = asyncio.ensure_future(self._run(self.database.write_batch, mappings, states))
+        self._writes.add(write)
+        write.add_done_callback(functools.partial(self._write_done, mappings, states))
+        await asyncio.shield(write)
+        return len(mappings) + len(states)
+
+    def _write_done(self, mappings: list, states: list, write: asyncio.Future):
+        self._writes.discard(write)
+        if write.cancelled() or write.exception() is not None:
+            # Транзакция откатилась - строки возвращаются в журнал до следующей попытки
+            self._pending_mappings[:0] = mappings
+            self.users.restore_dirty(states)
+            return
+        self.flushes += 1
+        self.flushed_rows += len(mappings) + len(states)
+        for manager_message_id, user_id, manager_chat_id in mappings:
+            key = (manager_chat_id, manager_message_id)
+            if self._pending_index.get(key) == user_id:
+                del self._pending_index[key]
+
+    async def run_maintenance(self, max_age_days: float, batch_size: int,
+                              vacuum_pages: int) -> Tuple[int, int]:
+        """
+        Архивировать старые связи и освободить место маленькими порциями.
+        Между порциями отдаём блокировку записи обработчикам.
+        Возвращает (перенесено строк, осталось свободных страниц).
+        """
+        archived = 0
+        while True:
+            moved = await self._run(self.database.archive_old_mappings, max_age_days, batch_size)
+            archived += moved
+            if moved < batch_size:
+                break
+            await asyncio.sleep(DB_MAINTENANCE_PAUSE)
+
+        free_pages = await self._run(self.database.incremental_vacuum, vacuum_pages)
+        while free_pages > 0:
+            await asyncio.sleep(DB_MAINTENANCE_PAUSE)
+            remaining = await self._run(self.database.incremental_vacuum, vacuum_pages)
+            if remaining >= free_pages:
+                # auto_vacuum не в режиме INCREMENTAL - освобождать нечего
+                break
+            free_pages = remaining
+        return archived, free_pages
+
+    async def close(self):
+        """Дописать журнал, дождаться текущих запросов и закрыть соединения"""
+        await asyncio.gather(*self._writes, return_exceptions=True)
+        await self.flush()
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+        self.database.close()
 
 
 # Глобальный экземпляр базы данных
-db = Database()
\ No newline at end of file
+db = Database()
+
+# Асинхронный доступ к той же базе для обработчиков
+adb = AsyncDatabase(db)
@@ -5,10 +5,89 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from telegram.constants import ParseMode
-from database import db
-from config import AUTO_REPLIES, MANAGER_COMMANDS, WELCOME_MESSAGE, INITIAL_MANAGERS, FAQ_ANSWERS
-from typing import Optional, Tuple
-import re
+from telegram.error import BadRequest
+from database import adb
+from config import (
+    MANAGER_COMMANDS,
+    WELCOME_MESSAGE,
+    INITIAL_MANAGERS,
+    FAQ_ANSWERS,
+    FANOUT_CONCURRENCY,
+    FANOUT_SEND_TIMEOUT,
+    MANAGER_GROUP_ID,
+    USER_BURST_WINDOW,
+    USER_BURST_MAX_CHARS,
+    AUTO_REPLY_DEFLECTION,
+    AUTO_REPLY_DEFLECTION_THRESHOLD,
+    AUTO_REPLY_DEFLECTION_MODE,
+)
+from outbound import (
+    outbound,
+    send_message,
+    reply_text,
+    edit_message_text,
+    PRIORITY_REPLY,
+    PRIORITY_NOTIFICATION,
+)
+from matcher import find_auto_reply, matcher
+from metrics import fanout_latency, fanout_failures, auto_reply_matches
+from profiling import profiler, section, SECTION_MATCHER, SECTION_API
+from collections import Counter
+from typing import Callable, Dict, List, Optional
+import asyncio
+import html
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Ключ FAQ по тексту ответа - для счётчиков автоответов
+FAQ_KEY_BY_ANSWER = {answer: key for key, answer in FAQ_ANSWERS.items()}
+
+# Счётчики автоответов, отправленных вместо пересылки менеджерам
+deflection_stats = {
+    "matched": 0,                 # сообщений, для которых нашёлся автоответ
+    "deflected": 0,               # из них отвечено без менеджеров
+    "manager_messages_saved": 0,  # сэкономлено уведомлений менеджерам
+    "by_faq": Counter(),
+}
+
+# Вопросы с автоответом, ждущие сводки для менеджеров (режим digest): хранятся только
+# первые DIGEST_MAX_ITEMS (с обрезанным текстом), остальные лишь считаются
+pending_digest = []
+DIGEST_MAX_ITEMS = 30
+DIGEST_TEXT_CHARS = 100
+digest_overflow = Counter()
+
+
+class PendingBurst:
+    """Сообщения пользователя, ждущие отправки менеджерам одним уведомлением"""
+
+    __slots__ = ("message", "user", "texts", "size", "is_first", "has_manager_replied", "ready")
+
+    def __init__(self, message, user, is_first: bool, has_manager_replied: bool):
+        self.message = message  # первое сообщение серии - на него отвечаем пользователю
+        self.user = user
+        self.texts = [message.text]
+        self.size = len(message.text)
+        self.is_first = is_first
+        self.has_manager_replied = has_manager_replied
+        self.ready = asyncio.Event()
+
+
+# Создаваемые сейчас темы группы менеджеров по user_id (одна тема на пользователя)
+topic_creations: Dict[int, asyncio.Future] = {}
+
+# Открытые серии по user_id и задачи, которые их отправляют
+pending_bursts: Dict[int, PendingBurst] = {}
+burst_deliveries = set()
+
+# Счётчики объединения серий
+burst_stats = {
+    "messages": 0,                # сообщений пользователей, ушедших менеджерам
+    "notifications": 0,           # отправленных по ним уведомлений (на каждого менеджера)
+    "manager_messages_saved": 0,  # сэкономлено вызовов sendMessage
+}
 
 def get_main_keyboard():
     """Создает главную клавиатуру с FAQ кнопками"""
@@ -50,67 +129,196 @@ def get_back_keyboard():
     return InlineKeyboardMarkup(keyboard)
 
 
-def normalize_text(text: str) -> str:
-    """Нормализация текста для лучшего поиска"""
-    text = text.lower()
-    text = text.replace('ё', 'е')
-    text = re.sub(r'[^\w\s]', ' ', text)
-    text = re.sub(r'\s+', ' ', text)
-    return text. strip()
+async def send_to_managers(bot, managers: List[tuple], text: str) -> List[tuple]:
+    """
+    Разослать сообщение всем менеджерам параллельно:
+    не больше FANOUT_CONCURRENCY отправок одновременно, каждая с таймаутом FANOUT_SEND_TIMEOUT.
+    Возвращает [(manager_id, manager_username, сообщение или исключение)] в порядке managers.
+    """
+    semaphore = asyncio.Semaphore(FANOUT_CONCURRENCY)
+
+    async def send_one(manager_id: int):
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                # Таймаут - только на сам вызов API: ожидание лимита чата в очереди не обрывает отправку
+                return await send_message(
+                    bot, manager_id, text,
+                    priority=PRIORITY_NOTIFICATION,
+                    call_timeout=FANOUT_SEND_TIMEOUT,
+                    parse_mode=ParseMode.HTML
+                )
+            except Exception:
+                fanout_failures.inc(manager_id)
+                raise
+            finally:
+                fanout_latency.observe(time.perf_counter() - started, manager_id)
+
+    results = await asyncio.gather(
+        *(send_one(manager_id) for manager_id, _ in managers),
+        return_exceptions=True
+    )
+    return [
+        (manager_id, manager_username, result)
+        for (manager_id, manager_username), result in zip(managers, results)
+    ]
 
 
-def find_auto_reply(message_text: str) -> Optional[Tuple[str, str]]:
+def topic_name(user) -> str:
+    """Название темы пользователя в группе менеджеров (Telegram допускает до 128 символов)"""
+    name = " ".join(part for part in (user.first_name, user.last_name) if part) or "Пользователь"
+    if user.username:
+        name += f" @{user.username}"
+    return f"{name[:100]} ({user.id})"
+
+
+async def create_user_topic(bot, user, stale_thread_id: int = None) -> int:
     """
-    Ищет подходящий автоответ по ключевым словам.
-    Возвращает (текст_ответа, совпавшее_ключевое_слово) или (None, None)
+    Создать тему пользователя в группе менеджеров и запомнить её в БД.
+    Параллельные вызовы для одного пользователя ждут одну и ту же тему.
     """
-    message_normalized = normalize_text(message_text)
+    creation = topic_creations.get(user.id)
+    if creation is None:
+        creation = topic_creations[user.id] = asyncio.ensure_future(
+            _create_user_topic(bot, user, stale_thread_id)
+        )
+        creation.add_done_callback(lambda _: topic_creations.pop(user.id, None))
+    return await asyncio.shield(creation)
 
-    best_match = None
-    best_score = 0
-    best_keyword = ""
 
-    for reply_item in AUTO_REPLIES:
-        keywords = reply_item["keywords"]
+async def _create_user_topic(bot, user, stale_thread_id) -> int:
+    thread_id = await adb.get_user_topic(MANAGER_GROUP_ID, user.id)
+    if thread_id is not None and thread_id != stale_thread_id:
+        # Тему уже завёл другой обработчик
+        return thread_id
 
-        for keyword in keywords:
-            keyword_normalized = normalize_text(keyword)
-            score = 0
+    topic = await outbound.submit(
+        MANAGER_GROUP_ID,
+        lambda: bot.create_forum_topic(chat_id=MANAGER_GROUP_ID, name=topic_name(user)),
+        PRIORITY_NOTIFICATION,
+        "createForumTopic"
+    )
+    await adb.save_user_topic(MANAGER_GROUP_ID, user.id, topic.message_thread_id)
+    return topic.message_thread_id
 
-            # 1. ТОЧНОЕ совпадение (высший приоритет)
-            if keyword_normalized == message_normalized:
-                score = 100
 
-            # 2. Ключевое слово ПОЛНОСТЬЮ содержится в сообщении
-            elif keyword_normalized in message_normalized:
-                score = 90
+async def send_to_topic(bot, user, render: Callable[[], str]):
+    """
+    Отправить уведомление в тему пользователя в группе менеджеров (одно на всех менеджеров).
+    Текст берётся из render() в момент, когда планировщик выдал токен группы: пока
+    уведомление ждёт лимита, в него ещё попадают новые сообщения пользователя.
+    """
+    thread_id = await adb.get_user_topic(MANAGER_GROUP_ID, user.id)
+    if thread_id is None:
+        thread_id = await create_user_topic(bot, user)
 
-            # 3. ВСЕ слова из ключевой фразы есть в сообщении
-            elif len(keyword_normalized. split()) > 1:
-                keyword_words = set(keyword_normalized.split())
-                message_words = set(message_normalized.split())
-                if keyword_words. issubset(message_words):
-                    score = 80
+    started = time.perf_counter()
+    try:
+        for attempt in range(2):
+            try:
+                return await outbound.submit(
+                    MANAGER_GROUP_ID,
+                    lambda: bot.send_message(
+                        chat_id=MANAGER_GROUP_ID,
+                        text=render(),
+                        parse_mode=ParseMode.HTML,
+                        message_thread_id=thread_id
+                    ),
+                    PRIORITY_NOTIFICATION,
+                    "sendMessage",
+                    FANOUT_SEND_TIMEOUT
+                )
+            except BadRequest as e:
+                if attempt or "thread not found" not in str(e).lower():
+                    raise
+                # Тему удалили в группе - заводим новую
+                thread_id = await create_user_topic(bot, user, stale_thread_id=thread_id)
+    except Exception:
+        fanout_failures.inc(MANAGER_GROUP_ID)
+        raise
+    finally:
+        fanout_latency.observe(time.perf_counter() - started, MANAGER_GROUP_ID)
+
+
+def format_manager_notification(user, text: str, is_first: bool, has_manager_replied: bool) -> str:
+    """Текст уведомления менеджерам о сообщении пользователя"""
+    user_info = f"👤 <b>{'🆕 НОВЫЙ пользователь' if is_first else 'Сообщение от пользователя'}</b>\n\n"
+    user_info += f"Имя: {user.first_name or 'Не указано'}"
+    if user.last_name:
+        user_info += f" {user.last_name}"
+    user_info += f"\nUsername: @{user.username or 'не указан'}"
+    user_info += f"\nID:  <code>{user.id}</code>"
+    user_info += f"\n\n📝 <b>Сообщение: </b>\n{text}"
 
-            # 4. Частичное совпадение слов (для коротких ключевых слов)
-            else:
-                keyword_words = set(keyword_normalized.split())
-                message_words = set(message_normalized.split())
-                matching_words = keyword_words.intersection(message_words)
-                if matching_words:
-                    # Чем больше совпадений, тем выше балл
-                    score = (len(matching_words) / len(keyword_words)) * 50
+    if has_manager_replied:
+        user_info += "\n\n💬 <i>Диалог с менеджером активен</i>"
+    return user_info
 
-            if score > best_score:
-                best_score = score
-                best_match = reply_item
-                best_keyword = keyword
 
-    # Порог для срабатывания:  50 (точное или частичное совпадение)
-    if best_score >= 50:
-        return (best_match["answer"], best_keyword)
+async def try_deflect(message, user) -> bool:
+    """
+    Ответить пользователю текстом FAQ, если автоответ уверенный.
+    Возвращает True, если пересылать сообщение менеджерам не нужно.
+    """
+    with section(SECTION_MATCHER, "match"):
+        match = matcher.match(message.text)
+    if match is None:
+        return False
+    faq_key = FAQ_KEY_BY_ANSWER.get(match.answer, str(match.reply_index))
+    deflection_stats["matched"] += 1
+    auto_reply_matches.inc(faq_key)
+    if match.score < AUTO_REPLY_DEFLECTION_THRESHOLD:
+        return False
+
+    await reply_text(
+        message,
+        match.answer,
+        parse_mode=ParseMode.HTML,
+        reply_markup=get_back_keyboard()
+    )
 
-    return (None, None)
+    recipients = 1 if MANAGER_GROUP_ID else len(await adb.get_all_managers())
+    deflection_stats["deflected"] += 1
+    deflection_stats["manager_messages_saved"] += recipients
+    deflection_stats["by_faq"][faq_key] += 1
+
+    if AUTO_REPLY_DEFLECTION_MODE == "digest":
+        if len(pending_digest) < DIGEST_MAX_ITEMS:
+            pending_digest.append((user.id, user.username, message.text[:DIGEST_TEXT_CHARS], faq_key))
+        else:
+            digest_overflow["items"] += 1
+    return True
+
+
+async def send_deflection_digest(bot):
+    """Отправить менеджерам одну сводку вопросов, закрытых автоответом"""
+    if not pending_digest:
+        return
+    items = pending_digest[:]
+    skipped = digest_overflow["items"]
+    pending_digest.clear()
+    digest_overflow.clear()
+
+    if MANAGER_GROUP_ID:
+        managers = [(MANAGER_GROUP_ID, "группа менеджеров")]
+    else:
+        managers = await adb.get_all_managers()
+    if not managers:
+        return
+
+    digest = f"🤖 <b>Автоответы за период: {len(items) + skipped}</b>\n\n"
+    for user_id, username, text, faq_key in items:
+        who = f"@{username}" if username else f"ID {user_id}"
+        digest += f"• {who}: <i>{html.escape(text)}</i> → {faq_key}\n"
+    if skipped:
+        digest += f"\n…и ещё {skipped}"
+
+    for manager_id, manager_username, result in await send_to_managers(bot, managers, digest):
+        if isinstance(result, BaseException):
+            logger.warning(
+                f"Ошибка отправки сводки менеджеру @{manager_username}: {result!r}",
+                extra={"manager_id": manager_id}
+            )
 
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -119,10 +327,11 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Автоматически добавляем начальных менеджеров
     if user.username and user.username in INITIAL_MANAGERS:
-        if not db.is_manager(user.id):
-            success = db.add_manager(user. id, user.username)
+        if not await adb.is_manager(user.id):
+            success = await adb.add_manager(user.id, user.username)
             if success:
-                await update.message. reply_text(
+                await reply_text(
+                    update.message,
                     f"✅ Вы автоматически добавлены как менеджер!\n\n"
                     f"👋 Добро пожаловать, {user.first_name}!\n\n{MANAGER_COMMANDS}",
                     parse_mode=ParseMode.HTML
@@ -130,15 +339,17 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 return
 
     # Если уже менеджер
-    if db.is_manager(user.id):
-        await update.message.reply_text(
+    if await adb.is_manager(user.id):
+        await reply_text(
+            update.message,
             f"👋 С возвращением, {user.first_name}!\n\n{MANAGER_COMMANDS}",
             parse_mode=ParseMode. HTML
         )
     else:
         # Обычный пользователь
         welcome_text = WELCOME_MESSAGE.format(first_name=user.first_name or "друг")
-        await update.message.reply_text(
+        await reply_text(
+            update.message,
             welcome_text,
             parse_mode=ParseMode.HTML,
             reply_markup=get_main_keyboard()
@@ -150,12 +361,13 @@ async def test_auto_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Тестирование автоответов для менеджеров"""
     user = update.effective_user
 
-    if not db.is_manager(user.id):
-        await update.message.reply_text("❌ У вас нет прав для этой команды.")
+    if not await adb.is_manager(user.id):
+        await reply_text(update.message, "❌ У вас нет прав для этой команды.")
         return
 
     if not context.args:
-        await update.message.reply_text(
+        await reply_text(
+            update.message,
             "❌ Использование:    /test_auto <текст сообщения>\n\n"
             "Пример:    /test_auto сколько стоит игра?"
         )
@@ -164,27 +376,38 @@ async def test_auto_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     test_message = " ".join(context.args)
     auto_reply_text, matched_keyword = find_auto_reply(test_message)
 
+    cache = matcher.cache.stats()
+    cache_info = (
+        f"🗂 Кэш автоответов: попаданий {cache['hits']}, промахов {cache['misses']} "
+        f"({cache['hit_ratio']:.0%}), вытеснений {cache['evictions']}, "
+        f"записей {cache['size']}/{cache['maxsize']}"
+    )
+
     if auto_reply_text:
         response = f"✅ <b>Найден автоответ! </b>\n\n"
         response += f"🔑 <b>Совпавший ключ:</b> <i>{matched_keyword}</i>\n\n"
-        response += f"📝 <b>Ответ пользователю:</b>\n\n{auto_reply_text}"
-        await update.message.reply_text(response, parse_mode=ParseMode.HTML)
+        response += f"📝 <b>Ответ пользователю:</b>\n\n{auto_reply_text}\n\n"
+        response += f"<i>{cache_info}</i>"
+        await reply_text(update.message, response, parse_mode=ParseMode.HTML)
     else:
-        await update.message.reply_text(
+        await reply_text(
+            update.message,
             f"❌ Автоответ не найден для:    \"{test_message}\"\n\n"
-            f"Менеджеру придется ответить вручную."
+            f"Менеджеру придется ответить вручную.\n\n"
+            f"{cache_info}"
         )
 
 async def add_manager_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Добавить нового менеджера"""
     user = update.effective_user
 
-    if not db.is_manager(user.id):
-        await update.message. reply_text("❌ У вас нет прав для этой команды.")
+    if not await adb.is_manager(user.id):
+        await reply_text(update.message, "❌ У вас нет прав для этой команды.")
         return
 
     if not context.args or len(context.args) != 1:
-        await update. message.reply_text(
+        await reply_text(
+            update.message,
             "❌ Использование: /add_manager @username\n\n"
             "Попросите пользователя СНАЧАЛА написать боту /start, затем добавьте его."
         )
@@ -193,13 +416,14 @@ async def add_manager_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     new_username = context.args[0]. lstrip("@")
 
     # Проверяем, уже есть?
-    managers = db.get_all_managers()
+    managers = await adb.get_all_managers()
     for manager_id, manager_username in managers:
         if manager_username == new_username:
-            await update.message.reply_text(f"⚠️ @{new_username} уже является менеджером!")
+            await reply_text(update.message, f"⚠️ @{new_username} уже является менеджером!")
             return
 
-    await update.message.reply_text(
+    await reply_text(
+        update.message,
         f"📝 Чтобы добавить @{new_username} как менеджера:\n\n"
         f"1️⃣ Попросите @{new_username} написать боту команду:  /request_manager\n"
         f"2️⃣ Вы получите уведомление с командой подтверждения\n"
@@ -212,24 +436,27 @@ async def request_manager_command(update: Update, context:  ContextTypes.DEFAULT
     user = update. effective_user
 
     if not user.username:
-        await update.message.reply_text(
+        await reply_text(
+            update.message,
             "❌ У вас не установлен username в Telegram.\n\n"
             "Установите его:  Settings → Edit Profile → Username\n"
             "Затем попробуйте снова."
         )
         return
 
-    if db.is_manager(user.id):
-        await update.message. reply_text(
+    if await adb.is_manager(user.id):
+        await reply_text(
+            update.message,
             f"✅ Вы уже менеджер!\n\n{MANAGER_COMMANDS}",
             parse_mode=ParseMode. HTML
         )
         return
 
-    managers = db.get_all_managers()
+    managers = await adb.get_all_managers()
 
     if not managers:
-        await update.message.reply_text(
+        await reply_text(
+            update.message,
             "⚠️ В системе пока нет менеджеров.  Обратитесь к администратору."
         )
         return
@@ -244,24 +471,24 @@ async def request_manager_command(update: Update, context:  ContextTypes.DEFAULT
     request_message += f"Чтобы добавить, выполните команду:\n<code>/approve_manager {user.id} {user.username}</code>"
 
     sent_count = 0
-    for manager_id, _ in managers:
-        try:
-            await context.bot.send_message(
-                chat_id=manager_id,
-                text=request_message,
-                parse_mode=ParseMode. HTML
+    for manager_id, _, result in await send_to_managers(context.bot, managers, request_message):
+        if isinstance(result, BaseException):
+            logger.warning(
+                f"Ошибка отправки менеджеру {manager_id}: {result!r}",
+                extra={"manager_id": manager_id}
             )
+        else:
             sent_count += 1
-        except Exception as e:
-            print(f"Ошибка отправки менеджеру {manager_id}: {e}")
 
     if sent_count > 0:
-        await update. message.reply_text(
+        await reply_text(
+            update.message,
             "✅ Ваш запрос отправлен менеджерам!\n"
             "Ожидайте подтверждения."
         )
     else:
-        await update. message.reply_text(
+        await reply_text(
+            update.message,
             "⚠️ Не удалось отправить запрос.  Попробуйте позже."
         )
 
@@ -270,12 +497,13 @@ async def approve_manager_command(update:  Update, context: ContextTypes. DEFAUL
     """Одобрить запрос на добавление менеджера"""
     user = update.effective_user
 
-    if not db.is_manager(user.id):
-        await update.message. reply_text("❌ У вас нет прав для этой команды.")
+    if not await adb.is_manager(user.id):
+        await reply_text(update.message, "❌ У вас нет прав для этой команды.")
         return
 
     if not context.args or len(context.args) != 2:
-        await update. message.reply_text(
+        await reply_text(
+            update.message,
             "❌ Использование:  /approve_manager USER_ID USERNAME"
         )
         return
@@ -284,68 +512,71 @@ async def approve_manager_command(update:  Update, context: ContextTypes. DEFAUL
         new_user_id = int(context.args[0])
         new_username = context.args[1]. lstrip("@")
     except (ValueError, IndexError):
-        await update.message.reply_text("❌ Неверный формат.  Проверьте команду.")
+        await reply_text(update.message, "❌ Неверный формат.  Проверьте команду.")
         return
 
-    if db.is_manager(new_user_id):
-        await update. message.reply_text(f"⚠️ @{new_username} уже менеджер!")
+    if await adb.is_manager(new_user_id):
+        await reply_text(update.message, f"⚠️ @{new_username} уже менеджер!")
         return
 
-    success = db.add_manager(new_user_id, new_username)
+    success = await adb.add_manager(new_user_id, new_username)
 
     if success:
-        await update.message.reply_text(
+        await reply_text(
+            update.message,
             f"✅ @{new_username} успешно добавлен как менеджер!"
         )
 
         try:
-            await context.bot. send_message(
-                chat_id=new_user_id,
-                text=f"🎉 Поздравляем!  Вы назначены менеджером.\n\n{MANAGER_COMMANDS}",
+            await send_message(
+                context.bot,
+                new_user_id,
+                f"🎉 Поздравляем!  Вы назначены менеджером.\n\n{MANAGER_COMMANDS}",
                 parse_mode=ParseMode. HTML
             )
         except:
             pass
     else:
-        await update.message.reply_text("❌ Ошибка при добавлении менеджера.")
+        await reply_text(update.message, "❌ Ошибка при добавлении менеджера.")
 
 
 async def remove_manager_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Удалить менеджера"""
     user = update.effective_user
 
-    if not db. is_manager(user.id):
-        await update.message.reply_text("❌ У вас нет прав для этой команды.")
+    if not await adb.is_manager(user.id):
+        await reply_text(update.message, "❌ У вас нет прав для этой команды.")
         return
 
     if not context.args or len(context.args) != 1:
-        await update.message.reply_text("❌ Использование: /remove_manager @username")
+        await reply_text(update.message, "❌ Использование: /remove_manager @username")
         return
 
     username = context.args[0].lstrip("@")
 
     if username == user.username:
-        await update.message.reply_text("❌ Вы не можете удалить сами себя!")
+        await reply_text(update.message, "❌ Вы не можете удалить сами себя!")
         return
 
-    if db.remove_manager(username):
-        await update.message. reply_text(f"✅ @{username} удален из менеджеров.")
+    if await adb.remove_manager(username):
+        await reply_text(update.message, f"✅ @{username} удален из менеджеров.")
     else:
-        await update.message.reply_text(f"❌ @{username} не найден в списке менеджеров.")
+        await reply_text(update.message, f"❌ @{username} не найден в списке менеджеров.")
 
 
 async def list_managers_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать список всех менеджеров"""
     user = update. effective_user
 
-    if not db.is_manager(user.id):
-        await update. message.reply_text("❌ У вас нет прав для этой команды.")
+    if not await adb.is_manager(user.id):
+        await reply_text(update.message, "❌ У вас нет прав для этой команды.")
         return
 
-    managers = db.get_all_managers()
+    managers = await adb.get_all_managers()
 
     if not managers:
-        await update.message.reply_text(
+        await reply_text(
+            update.message,
             "📋 Список менеджеров пуст.\n\n"
             "Начальные менеджеры должны написать боту /start для активации."
         )
@@ -357,7 +588,165 @@ async def list_managers_command(update: Update, context: ContextTypes.DEFAULT_TY
 
     message += f"<i>Всего:  {len(managers)}</i>"
 
-    await update.message.reply_text(message, parse_mode=ParseMode.HTML)
+    await reply_text(update.message, message, parse_mode=ParseMode.HTML)
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показать статистику работы бота"""
+    user = update.effective_user
+
+    if not await adb.is_manager(user.id):
+        await reply_text(update.message, "❌ У вас нет прав для этой команды.")
+        return
+
+    stats = outbound.stats()
+    queued = stats["queued"]
+    message = "📊 <b>Статистика бота</b>\n\n"
+    message += "<b>Исходящие сообщения:</b>\n"
+    message += (
+        f"В очереди: ответы {queued['reply']}, интерактив {queued['interactive']}, "
+        f"уведомления {queued['notification']}\n"
+    )
+    message += f"Ждут лимита: {stats['deferred']}\n"
+    message += f"Отправляются: {stats['in_flight']}\n"
+    message += f"Отправлено: {stats['sent']}\n"
+    message += f"Повторов после 429: {stats['retried']}\n"
+    message += f"Ошибок: {stats['failed']}\n"
+    message += f"Отменено по таймауту: {stats['dropped']}\n\n"
+
+    users = adb.users.stats()
+    message += "<b>Кэш пользователей:</b>\n"
+    message += f"В памяти: {users['size']} из {users['maxsize']}, ждут записи: {users['dirty']}\n"
+    message += f"Попаданий: {users['hits']}, промахов: {users['misses']} ({users['hit_ratio']:.0%})\n"
+    routes = adb.routes.stats()
+    message += (
+        f"Индекс ответов: {routes['size']} из {routes['maxsize']}, найдено в памяти "
+        f"{routes['hits']} из {routes['hits'] + routes['misses']} ({routes['hit_ratio']:.0%})\n"
+    )
+    if MANAGER_GROUP_ID:
+        message += f"Темы пользователей в памяти: {len(adb.topics)} из {adb.topics.maxsize}\n"
+    message += (
+        f"Отложенная запись: ждут {adb.pending_writes}, записано {adb.flushed_rows} "
+        f"строк за {adb.flushes} транзакций\n\n"
+    )
+
+    message += "<b>Серии сообщений:</b>\n"
+    if USER_BURST_WINDOW > 0:
+        message += f"Окно: {USER_BURST_WINDOW:g} с\n"
+    else:
+        message += "Окно: выключено\n"
+    message += (
+        f"Сообщений: {burst_stats['messages']}, уведомлений: {burst_stats['notifications']}, "
+        f"сэкономлено отправок: {burst_stats['manager_messages_saved']}\n\n"
+    )
+
+    message += "<b>Автоответы:</b>\n"
+    if AUTO_REPLY_DEFLECTION:
+        message += f"Режим: {AUTO_REPLY_DEFLECTION_MODE}, порог {AUTO_REPLY_DEFLECTION_THRESHOLD:g}\n"
+    else:
+        message += "Режим: выключены\n"
+    message += f"Найдено совпадений: {deflection_stats['matched']}\n"
+    message += f"Отвечено без менеджеров: {deflection_stats['deflected']}\n"
+    message += f"Сэкономлено уведомлений: {deflection_stats['manager_messages_saved']}"
+    for faq_key, count in deflection_stats["by_faq"].most_common():
+        message += f"\n• {faq_key}: {count}"
+
+    await reply_text(update.message, message, parse_mode=ParseMode.HTML)
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Управление выборочным профилированием: on [доля] | off | dump | reset"""
+    user = update.effective_user
+
+    if not await adb.is_manager(user.id):
+        await reply_text(update.message, "❌ У вас нет прав для этой команды.")
+        return
+
+    action = context.args[0].lower() if context.args else "status"
+
+    if action == "on":
+        try:
+            rate = float(context.args[1]) if len(context.args) > 1 else 0.1
+        except ValueError:
+            await reply_text(update.message, "❌ Использование: /profile on 0.1")
+            return
+        profiler.configure(rate)
+        await reply_text(update.message, f"✅ Профилирование включено: {profiler.sample_rate:.0%} апдейтов")
+        return
+
+    if action == "off":
+        profiler.configure(0)
+        await reply_text(update.message, "✅ Профилирование выключено")
+        return
+
+    if action == "reset":
+        profiler.reset()
+        await reply_text(update.message, "✅ Накопленные замеры сброшены")
+        return
+
+    if action == "dump":
+        paths = await asyncio.get_running_loop().run_in_executor(None, profiler.dump)
+        await reply_text(
+            update.message,
+            "💾 Профиль сохранён:\n" + "\n".join(f"<code>{html.escape(path)}</code>" for path in paths),
+            parse_mode=ParseMode.HTML
+        )
+        return
+
+    summary = profiler.summary()
+    message = "🔬 <b>Профилирование</b>\n\n"
+    message += f"Доля: {summary['sample_rate']:.0%}, замерено {summary['sampled']} из {summary['seen']}\n"
+    cpu_wall = summary["cpu_wall"] or 1e-9
+    message += (
+        f"CPU процесса: {summary['cpu']:.1f} с за {cpu_wall:.0f} с ({summary['cpu'] / cpu_wall:.0%}), "
+        f"все апдейты и потоки БД\n"
+    )
+    message += "<i>Доли участков от общего времени; параллельная рассылка даёт больше 100%</i>\n"
+    for kind, sections in sorted(summary["sections"].items()):
+        wall = summary["wall"].get(kind, 0) or 1e-9
+        parts = ", ".join(
+            f"{name} {seconds / wall:.0%}" for name, seconds in sections.most_common()
+        )
+        message += (
+            f"\n<b>{html.escape(kind)}</b>: {wall * 1000:.0f} мс\n{parts}\n"
+        )
+    await reply_text(update.message, message, parse_mode=ParseMode.HTML)
+
+
+async def forward_manager_reply(bot, message, user_id: int, confirm: bool = True):
+    """Переслать ответ менеджера пользователю"""
+    try:
+        await send_message(
+            bot,
+            user_id,
+            message.text,
+            priority=PRIORITY_REPLY
+        )
+
+        # Отмечаем что менеджер ответил
+        await adb.set_manager_replied(user_id)
+
+        if confirm:
+            await reply_text(message, "✅ Ответ отправлен пользователю")
+    except Exception as e:
+        await reply_text(message, f"❌ Ошибка отправки:  {str(e)}")
+
+
+async def handle_group_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сообщение в группе менеджеров: написанное в теме пользователя уходит ему"""
+    message = update.message
+
+    user_id = None
+    if message.is_topic_message and message.message_thread_id:
+        user_id = await adb.get_user_by_topic(MANAGER_GROUP_ID, message.message_thread_id)
+    if user_id is None and message.reply_to_message:
+        user_id = await adb.get_user_by_message(message.reply_to_message.message_id, message.chat_id)
+    if user_id is None:
+        # Обсуждение менеджеров вне тем пользователей
+        return
+
+    # Подтверждение в общей группе только тратило бы её лимит сообщений - сообщаем лишь об ошибке
+    await forward_manager_reply(context.bot, message, user_id, confirm=False)
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -365,34 +754,30 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     message = update.message
 
+    # Сообщение в группе менеджеров
+    if MANAGER_GROUP_ID and message.chat_id == MANAGER_GROUP_ID:
+        await handle_group_message(update, context)
+        return
+
     # Если сообщение от менеджера
-    if db.is_manager(user.id):
+    if await adb.is_manager(user.id):
         if message.reply_to_message:
-            user_id = db.get_user_by_message(
+            user_id = await adb.get_user_by_message(
                 message.reply_to_message.message_id,
                 message.chat_id
             )
 
             if user_id:
-                try:
-                    await context.bot.send_message(
-                        chat_id=user_id,
-                        text=message.text
-                    )
-
-                    # Отмечаем что менеджер ответил
-                    db.set_manager_replied(user_id)
-
-                    await message.reply_text("✅ Ответ отправлен пользователю")
-                except Exception as e:
-                    await message.reply_text(f"❌ Ошибка отправки:  {str(e)}")
+                await forward_manager_reply(context.bot, message, user_id)
             else:
-                await message.reply_text(
+                await reply_text(
+                    message,
                     "❌ Не удалось найти пользователя.\n"
                     "Убедитесь что отвечаете (Reply) на сообщение от пользователя."
                 )
         else:
-            await message. reply_text(
+            await reply_text(
+                message,
                 "💡 Чтобы ответить пользователю:\n"
                 "Ответьте (Reply) на его сообщение\n\n"
                 f"{MANAGER_COMMANDS}",
@@ -401,66 +786,152 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Если сообщение от обычного пользователя
     else:
-        is_first = db.is_first_message(user.id)
-        has_manager_replied = db.has_manager_replied(user.id)
+        # Знакомый пользователь - из памяти, без SQL; чтение состояния не меняет
+        has_manager_replied = await adb.has_manager_replied(user.id)
+
+        # Пока менеджер не ведёт диалог, типовые вопросы закрываем автоответом.
+        # Посреди открытой серии не закрываем: вопрос уйдёт менеджерам вместе с ней,
+        # а не выпадет из уведомления
+        if AUTO_REPLY_DEFLECTION and not has_manager_replied and user.id not in pending_bursts:
+            if await try_deflect(message, user):
+                return
 
-        # Формируем сообщение для менеджеров
-        user_info = f"👤 <b>{'🆕 НОВЫЙ пользователь' if is_first else 'Сообщение от пользователя'}</b>\n\n"
-        user_info += f"Имя: {user.first_name or 'Не указано'}"
-        if user.last_name:
-            user_info += f" {user.last_name}"
-        user_info += f"\nUsername: @{user.username or 'не указан'}"
-        user_info += f"\nID:  <code>{user.id}</code>"
-        user_info += f"\n\n📝 <b>Сообщение: </b>\n{message.text}"
+        # Первым считается первое сообщение, дошедшее до менеджеров (а не закрытое автоответом)
+        is_first = await adb.is_first_message(user.id)
 
-        if has_manager_replied:
-            user_info += "\n\n💬 <i>Диалог с менеджером активен</i>"
+        if USER_BURST_WINDOW <= 0:
+            await deliver_to_managers(context.bot, message, user, [message.text],
+                                      is_first, has_manager_replied)
+            return
+
+        burst = pending_bursts.get(user.id)
+        if burst is not None and burst.size + len(message.text) <= USER_BURST_MAX_CHARS:
+            burst.texts.append(message.text)
+            burst.size += len(message.text)
+            return
+        if burst is not None:
+            # Серия слишком длинная для одного сообщения - отправляем её сейчас
+            del pending_bursts[user.id]
+            burst.ready.set()
+
+        burst = pending_bursts[user.id] = PendingBurst(message, user, is_first, has_manager_replied)
+        task = context.application.create_task(deliver_burst(context.bot, burst), update=update)
+        burst_deliveries.add(task)
+        task.add_done_callback(burst_deliveries.discard)
 
+
+async def flush_bursts():
+    """Отправить все открытые серии, не дожидаясь окна, и дождаться отправки"""
+    for burst in pending_bursts.values():
+        burst.ready.set()
+    await asyncio.gather(*burst_deliveries, return_exceptions=True)
+
+
+async def deliver_burst(bot, burst: PendingBurst):
+    """Подождать окно серии и отправить накопленные сообщения одним уведомлением"""
+    try:
+        await asyncio.wait_for(burst.ready.wait(), USER_BURST_WINDOW)
+    except asyncio.TimeoutError:
+        pass
+    if not MANAGER_GROUP_ID:
+        close_burst(burst)
+    # В группе серия остаётся открытой, пока уведомление ждёт лимита группы (20 в минуту):
+    # сообщения, пришедшие за это время, уйдут в том же уведомлении
+    try:
+        # Отправка идёт после finish_update апдейта - профилируем её отдельно, без ожидания окна
+        with profiler.background("burst_delivery"):
+            await deliver_to_managers(bot, burst.message, burst.user, burst.texts,
+                                      burst.is_first, burst.has_manager_replied, burst)
+    finally:
+        close_burst(burst)
+
+
+def close_burst(burst: PendingBurst):
+    """Закрыть серию: следующие сообщения пользователя начнут новую"""
+    if pending_bursts.get(burst.user.id) is burst:
+        del pending_bursts[burst.user.id]
+
+
+async def deliver_to_managers(bot, message, user, texts: List[str],
+                              is_first: bool, has_manager_replied: bool,
+                              burst: Optional[PendingBurst] = None):
+    """
+    Отправить менеджерам уведомление о сообщениях пользователя и сохранить связи.
+    burst - серия, которой принадлежат texts; при отправке в группу она закрывается
+    в момент вызова API, а не раньше.
+    """
+    def render() -> str:
+        if burst is not None:
+            close_burst(burst)
+        return format_manager_notification(user, "\n".join(texts), is_first, has_manager_replied)
+
+    mappings = []
+    if MANAGER_GROUP_ID:
+        # Одно сообщение в тему пользователя, сколько бы ни было менеджеров
+        recipients = 1
+        try:
+            sent = await send_to_topic(bot, user, render)
+            mappings.append((sent.message_id, user.id, MANAGER_GROUP_ID))
+        except Exception as e:
+            logger.warning(
+                f"Ошибка отправки в группу менеджеров: {e!r}",
+                extra={"manager_id": MANAGER_GROUP_ID}
+            )
+    else:
         # Отправляем всем менеджерам
-        managers = db.get_all_managers()
+        managers = await adb.get_all_managers()
 
         if not managers:
-            await message.reply_text(
+            await reply_text(
+                message,
                 "⚠️ К сожалению, сейчас нет доступных менеджеров.\n"
                 "Пожалуйста, попробуйте позже."
             )
             return
 
-        sent_count = 0
-        for manager_id, manager_username in managers:
-            try:
-                sent_message = await context.bot.send_message(
-                    chat_id=manager_id,
-                    text=user_info,
-                    parse_mode=ParseMode. HTML
+        recipients = len(managers)
+        for manager_id, manager_username, result in await send_to_managers(bot, managers, render()):
+            if isinstance(result, BaseException):
+                logger.warning(
+                    f"Ошибка отправки менеджеру @{manager_username}: {result!r}",
+                    extra={"manager_id": manager_id}
                 )
-                db.save_message_mapping(sent_message.message_id, user. id, manager_id)
-                sent_count += 1
-            except Exception as e:
-                print(f"Ошибка отправки менеджеру @{manager_username}: {e}")
-
-        if sent_count == 0:
-            await message. reply_text(
-                "⚠️ Произошла ошибка при отправке сообщения.\n"
-                "Пожалуйста, попробуйте позже."
-            )
-        elif is_first:
-            await message.reply_text(
-                "✅ Ваше сообщение получено!\n"
-                "Наши менеджеры ответят вам в ближайшее время."
-            )
+            else:
+                mappings.append((result.message_id, user.id, manager_id))
+
+    burst_stats["messages"] += len(texts)
+    burst_stats["notifications"] += 1
+    burst_stats["manager_messages_saved"] += (len(texts) - 1) * recipients
+
+    # Все успешные отправки сохраняем одной транзакцией
+    if mappings:
+        await adb.save_message_mappings(mappings)
+
+    if not mappings:
+        await reply_text(
+            message,
+            "⚠️ Произошла ошибка при отправке сообщения.\n"
+            "Пожалуйста, попробуйте позже."
+        )
+    elif is_first:
+        await reply_text(
+            message,
+            "✅ Ваше сообщение получено!\n"
+            "Наши менеджеры ответят вам в ближайшее время."
+        )
 
 
 async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать главное меню"""
     user = update.effective_user
 
-    if db.is_manager(user.id):
+    if await adb.is_manager(user.id):
         text = f"🧪 <b>Тестовое меню для {user.first_name}</b>\n\nВы можете протестировать кнопки как обычный пользователь:"
     else:
         text = WELCOME_MESSAGE.format(first_name=user.first_name or "друг")
 
-    await update.message.reply_text(
+    await reply_text(
+        update.message,
         text,
         parse_mode=ParseMode.HTML,
         reply_markup=get_main_keyboard()
@@ -470,7 +941,8 @@ async def menu_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик нажатий на кнопки"""
     query = update.callback_query
-    await query.answer()
+    with section(SECTION_API, "answerCallbackQuery"):
+        await query.answer()
 
     user = query.from_user
     data = query.data
@@ -481,8 +953,9 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
         answer_text = FAQ_ANSWERS.get(faq_key, "Информация не найдена")
 
         # Отправляем ответ с кнопками "Назад" и "Написать менеджеру"
-        await query.edit_message_text(
-            text=answer_text,
+        await edit_message_text(
+            query,
+            answer_text,
             parse_mode=ParseMode.HTML,
             reply_markup=get_back_keyboard()
         )
@@ -490,15 +963,17 @@ async def handle_callback_query(update: Update, context: ContextTypes.DEFAULT_TY
     # Кнопка "Назад в меню"
     elif data == "back_to_menu":
         welcome_text = WELCOME_MESSAGE.format(first_name=user.first_name or "друг")
-        await query.edit_message_text(
-            text=welcome_text,
+        await edit_message_text(
+            query,
+            welcome_text,
             parse_mode=ParseMode.HTML,
             reply_markup=get_main_keyboard()
         )
 
     # Кнопка "Написать менеджеру"
     elif data == "contact_manager":
-        await query.edit_message_text(
-            text="✍️ <b>Напишите ваш вопрос</b>\n\nОтправьте сообщение, и менеджер ответит вам в ближайшее время.",
+        await edit_message_text(
+            query,
+            "✍️ <b>Напишите ваш вопрос</b>\n\nОтправьте сообщение, и менеджер ответит вам в ближайшее время.",
             parse_mode=ParseMode.HTML
         )
\ No newline at end of file
@@ -0,0 +1,118 @@
+"""
+Сторож event loop: задержка цикла и поиск блокирующих вызовов
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Optional
+from config import (
+    LOOP_WATCHDOG_INTERVAL,
+    LOOP_BLOCK_THRESHOLD,
+    LOOP_LAG_UNHEALTHY,
+    LOOP_LAG_WINDOW,
+)
+from metrics import loop_lag, loop_lag_histogram, loop_stalls
+
+logger = logging.getLogger(__name__)
+
+
+class LoopWatchdog:
+    """
+    Задача в event loop раз в interval отмечает, на сколько опоздал её sleep
+    (это и есть задержка цикла). Отдельный поток следит за отметками: если
+    цикл молчит дольше block_threshold, в лог пишется стек потока event loop -
+    то место, где его заблокировали.
+    """
+
+    def __init__(self, interval: float = LOOP_WATCHDOG_INTERVAL,
+                 block_threshold: float = LOOP_BLOCK_THRESHOLD,
+                 unhealthy_lag: float = LOOP_LAG_UNHEALTHY,
+                 window: float = LOOP_LAG_WINDOW):
+        self.interval = interval
+        self.block_threshold = block_threshold
+        self.unhealthy_lag = unhealthy_lag
+        self.window = window
+
+        self.lag = 0.0
+        self.stalls = 0
+        self._samples = deque()   # (время, задержка) заметных задержек за окно
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Запустить замер в текущем event loop и поток-наблюдатель"""
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._tick())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval * 2)
+            self._thread = None
+
+    async def _tick(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            self._record(now, max(0.0, now - expected))
+
+    def _record(self, now: float, lag: float):
+        self.lag = lag
+        loop_lag.set(lag)
+        loop_lag_histogram.observe(lag)
+        # Для окна храним только заметные задержки - обычно очередь пустая
+        if lag >= self.interval:
+            self._samples.append((now, lag))
+        while self._samples and self._samples[0][0] < now - self.window:
+            self._samples.popleft()
+
+    def _watch(self):
+        """Поток-наблюдатель: стек event loop при блокировке дольше порога"""
+        reported = False
+        while not self._stop.wait(self.interval):
+            blocked_for = time.monotonic() - self._heartbeat
+            if blocked_for < self.block_threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            reported = True
+            self.stalls += 1
+            loop_stalls.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "стек недоступен"
+            logger.warning(
+                "Event loop заблокирован уже %.3f с, текущий стек потока loop:\n%s",
+                blocked_for, stack
+            )
+
+    def recent_lag(self) -> float:
+        """Наибольшая задержка за окно, включая текущую блокировку"""
+        now = time.monotonic()
+        worst = max((lag for at, lag in self._samples if at >= now - self.window), default=self.lag)
+        return max(worst, now - self._heartbeat - self.interval)
+
+    def is_healthy(self) -> bool:
+        return self.recent_lag() < self.unhealthy_lag
+
+
+# Глобальный сторож (запускается в post_init)
+watchdog = LoopWatchdog()
@@ -3,9 +3,42 @@
 """
 
 import logging
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler
-from config import BOT_TOKEN, INITIAL_MANAGERS
-from database import db
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler, TypeHandler
+from config import (
+    BOT_TOKEN,
+    BOT_API_BASE_URL,
+    HTTP_POOL_SIZE,
+    HTTP_VERSION,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    HTTP_WRITE_TIMEOUT,
+    HTTP_POOL_TIMEOUT,
+    GET_UPDATES_POOL_SIZE,
+    GET_UPDATES_READ_TIMEOUT,
+    BOT_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONNECTIONS,
+    HTTP_SERVER_PORT,
+    CONCURRENT_UPDATES,
+    INITIAL_MANAGERS,
+    MAPPING_RETENTION_DAYS,
+    DB_MAINTENANCE_INTERVAL,
+    DB_MAINTENANCE_BATCH,
+    DB_VACUUM_PAGES,
+    WRITE_BEHIND_INTERVAL,
+    AUTO_REPLY_DEFLECTION,
+    AUTO_REPLY_DEFLECTION_MODE,
+    AUTO_REPLY_DIGEST_INTERVAL,
+)
+from database import adb
+from outbound import outbound
+from metrics import registry, timed_handler
+from profiling import profiler
+from loop_watchdog import watchdog
+from update_processor import ChatOrderedUpdateProcessor
+from structured_logging import setup_logging, stop_logging, with_log_context
 from handlers import (
     start_command,
     menu_command,
@@ -15,100 +48,305 @@ from handlers import (
     request_manager_command,
     approve_manager_command,
     test_auto_command,
+    stats_command,
+    profile_command,
     handle_message,
-    handle_callback_query
+    handle_callback_query,
+    send_deflection_digest,
 )
 import asyncio
+import hmac
+import importlib.util
+import json
+import secrets
+import signal
 from aiohttp import web
+from telegram import Update
 from telegram.request import HTTPXRequest
 from telegram.ext import ExtBot
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Настройка логирования: запись через очередь, вывод в фоновом потоке
+setup_logging()
 logger = logging.getLogger(__name__)
 
+# Фоновые задачи, запущенные в post_init (отменяются в post_shutdown)
+background_tasks = []
+
+# Типы апдейтов, которые обрабатывает бот
+ALLOWED_UPDATES = ["message", "callback_query"]
+
+APPLICATION_KEY = web.AppKey("application", Application)
+
+# Запущенный HTTP сервер (останавливается в post_shutdown)
+web_runner = None
+
+# Секрет webhook: из конфига или случайный на время жизни процесса
+webhook_secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+
 
 # Простой HTTP сервер для проверки здоровья
 async def health_check(request):
-    """Эндпоинт для проверки что бот жив"""
+    """Эндпоинт для проверки что бот жив и event loop не тормозит"""
+    if not watchdog.is_healthy():
+        return web.Response(text=f"LOOP LAG {watchdog.recent_lag():.3f}s", status=503)
     return web.Response(text="OK", status=200)
 
 
-async def start_health_server():
-    """Запуск HTTP сервера для мониторинга"""
+async def metrics_handler(request):
+    """Метрики в текстовом формате Prometheus"""
+    # Версия текстового формата передаётся параметром Content-Type, как ждёт Prometheus
+    return web.Response(text=registry.render(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def telegram_webhook(request):
+    """Приём апдейта от Telegram: проверка секрета и передача в очередь Application"""
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(token, webhook_secret):
+        return web.Response(status=403)
+
+    application = request.app[APPLICATION_KEY]
+    try:
+        data = await request.json()
+        # Апдейт - JSON-объект; массив, строка или null - не апдейт
+        if not isinstance(data, dict):
+            return web.Response(status=400)
+        update = Update.de_json(data, application.bot)
+    except (json.JSONDecodeError, TypeError, KeyError, ValueError, AttributeError):
+        # AttributeError - вложенное поле не того типа, например "message": 5
+        return web.Response(status=400)
+
+    await application.update_queue.put(update)
+    return web.Response(status=200)
+
+
+def create_web_app(application: Application) -> web.Application:
+    """aiohttp-приложение бота: /health, /metrics и, в режиме webhook, маршрут для Telegram"""
     app = web.Application()
+    app[APPLICATION_KEY] = application
     app.router.add_get('/health', health_check)
-    runner = web.AppRunner(app)
-    await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', 8080)
+    app.router.add_get('/metrics', metrics_handler)
+    if BOT_MODE == "webhook":
+        app.router.add_post(WEBHOOK_PATH, telegram_webhook)
+    return app
+
+
+async def start_health_server(application: Application):
+    """Запуск HTTP сервера для мониторинга (и webhook)"""
+    global web_runner
+    web_runner = web.AppRunner(create_web_app(application))
+    await web_runner.setup()
+    site = web.TCPSite(web_runner, '0.0.0.0', HTTP_SERVER_PORT)
     await site.start()
-    logger.info("Health check сервер запущен на порту 8080")
+    logger.info(f"HTTP сервер запущен на порту {HTTP_SERVER_PORT}")
 
 
-def init_managers():
+async def init_managers():
     """Инициализация начальных менеджеров при старте бота"""
     logger.info("Проверка начальных менеджеров...")
-    existing_managers = db.get_all_managers()
+    # Заполняем кэш менеджеров: дальше проверки ролей идут без SQL
+    existing_managers = await adb.load_managers()
     existing_usernames = [username for _, username in existing_managers]
     logger.info(f"Менеджеры в БД: {existing_usernames}")
 
 
+async def db_maintenance_loop():
+    """Периодическое архивирование старых связей сообщений и освобождение места в БД"""
+    while True:
+        await asyncio.sleep(DB_MAINTENANCE_INTERVAL)
+        try:
+            archived, free_pages = await adb.run_maintenance(
+                MAPPING_RETENTION_DAYS, DB_MAINTENANCE_BATCH, DB_VACUUM_PAGES
+            )
+            if archived:
+                logger.info(f"Обслуживание БД: в архив перенесено {archived} связей")
+        except Exception as e:
+            logger.error(f"Ошибка обслуживания БД: {e}")
+
+
+async def write_behind_loop():
+    """Сброс отложенных записей (связи сообщений, состояния пользователей) в БД"""
+    while True:
+        await adb.wait_for_writes(WRITE_BEHIND_INTERVAL)
+        try:
+            await adb.flush()
+        except Exception as e:
+            logger.error(f"Ошибка отложенной записи в БД: {e}")
+
+
+async def deflection_digest_loop(application: Application):
+    """Периодическая сводка вопросов, закрытых автоответом"""
+    while True:
+        await asyncio.sleep(AUTO_REPLY_DIGEST_INTERVAL)
+        try:
+            await send_deflection_digest(application.bot)
+        except Exception as e:
+            logger.error(f"Ошибка отправки сводки автоответов: {e}")
+
+
 async def post_init(application: Application):
     """Инициализация после запуска бота"""
+    # Сторож event loop - первым, чтобы видеть и блокировки при старте
+    watchdog.start()
+
     bot = application.bot
     bot_info = await bot.get_me()
     logger.info(f"Бот запущен:   @{bot_info.username}")
-    init_managers()
+    await init_managers()
+
+    # Запускаем HTTP сервер (health check и webhook) до приёма апдейтов
+    await start_health_server(application)
+
+    background_tasks.append(asyncio.create_task(write_behind_loop()))
+
+    if MAPPING_RETENTION_DAYS > 0:
+        background_tasks.append(asyncio.create_task(db_maintenance_loop()))
 
-    # Запускаем health check сервер
-    asyncio.create_task(start_health_server())
+    if AUTO_REPLY_DEFLECTION and AUTO_REPLY_DEFLECTION_MODE == "digest":
+        background_tasks.append(asyncio.create_task(deflection_digest_loop(application)))
 
     logger.info("Бот готов к работе!")
 
 
-def main():
-    """Запуск бота"""
+async def post_shutdown(application: Application):
+    """Освобождение ресурсов после остановки бота"""
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
 
-    request = HTTPXRequest(
-        connect_timeout=30,
-        read_timeout=30,
-        write_timeout=30,
-        pool_timeout=30,
-    )
-    bot = ExtBot(
-        token=BOT_TOKEN,
-        base_url="https://test.pomidorka-i-f.workers.dev/tg/",
-        request=request,
-    )
+    await watchdog.stop()
+
+    global web_runner
+    if web_runner is not None:
+        await web_runner.cleanup()
+        web_runner = None
+
+    await outbound.close()
+    await adb.close()
+    logger.info("Соединения с БД закрыты")
+    stop_logging()
+
+
+def instrumented(callback):
+    """Обработчик с метриками и полями апдейта в логах"""
+    return timed_handler(with_log_context(callback))
+
+
+def build_application(bot: ExtBot) -> Application:
+    """Собрать Application со всеми обработчиками (используется и нагрузочным тестом)"""
     application = (
         Application.builder()
         .bot(bot)
         .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(
+            ChatOrderedUpdateProcessor(CONCURRENT_UPDATES) if CONCURRENT_UPDATES > 0 else False
+        )
         .build()
     )
 
+    # Профилирование: начало замера до всех обработчиков (группа -1), конец - после них (группа 1)
+    application.add_handler(TypeHandler(Update, profiler.start_update), group=-1)
+    application.add_handler(TypeHandler(Update, profiler.finish_update), group=1)
+
     # Регистрируем обработчики команд
-    application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CommandHandler("menu", menu_command))
-    application.add_handler(CommandHandler("request_manager", request_manager_command))
-    application.add_handler(CommandHandler("approve_manager", approve_manager_command))
-    application.add_handler(CommandHandler("add_manager", add_manager_command))
-    application.add_handler(CommandHandler("remove_manager", remove_manager_command))
-    application.add_handler(CommandHandler("list_managers", list_managers_command))
-    application.add_handler(CommandHandler("test_auto", test_auto_command))
+    application.add_handler(CommandHandler("start", instrumented(start_command)))
+    application.add_handler(CommandHandler("menu", instrumented(menu_command)))
+    application.add_handler(CommandHandler("request_manager", instrumented(request_manager_command)))
+    application.add_handler(CommandHandler("approve_manager", instrumented(approve_manager_command)))
+    application.add_handler(CommandHandler("add_manager", instrumented(add_manager_command)))
+    application.add_handler(CommandHandler("remove_manager", instrumented(remove_manager_command)))
+    application.add_handler(CommandHandler("list_managers", instrumented(list_managers_command)))
+    application.add_handler(CommandHandler("test_auto", instrumented(test_auto_command)))
+    application.add_handler(CommandHandler("stats", instrumented(stats_command)))
+    application.add_handler(CommandHandler("profile", instrumented(profile_command)))
 
     # Обработчик нажатий на кнопки (ВАЖНО: добавить ДО текстовых сообщений!)
-    application.add_handler(CallbackQueryHandler(handle_callback_query))
+    application.add_handler(CallbackQueryHandler(instrumented(handle_callback_query)))
 
     # Обработчик всех текстовых сообщений
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, instrumented(handle_message)))
+    return application
+
+
+def build_bot(base_url: str = BOT_API_BASE_URL, pool_size: int = HTTP_POOL_SIZE,
+              http_version: str = HTTP_VERSION) -> ExtBot:
+    """
+    ExtBot с настроенным транспортом: общий пул keep-alive соединений для
+    отправок и отдельный пул для long polling, чтобы getUpdates не занимал слот.
+    """
+    if http_version == "2" and importlib.util.find_spec("h2") is None:
+        logger.warning("Для HTTP/2 нужен пакет h2 (python-telegram-bot[http2]), используется HTTP/1.1")
+        http_version = "1.1"
+
+    request = HTTPXRequest(
+        connection_pool_size=pool_size,
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=HTTP_READ_TIMEOUT,
+        write_timeout=HTTP_WRITE_TIMEOUT,
+        pool_timeout=HTTP_POOL_TIMEOUT,
+        http_version=http_version,
+    )
+    get_updates_request = HTTPXRequest(
+        connection_pool_size=GET_UPDATES_POOL_SIZE,
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=GET_UPDATES_READ_TIMEOUT,
+        write_timeout=HTTP_WRITE_TIMEOUT,
+        pool_timeout=HTTP_POOL_TIMEOUT,
+        http_version=http_version,
+    )
+    return ExtBot(
+        token=BOT_TOKEN,
+        base_url=base_url,
+        request=request,
+        get_updates_request=get_updates_request,
+    )
+
+
+async def run_webhook(application: Application):
+    """
+    Режим webhook: апдейты приходят POST-запросами на HTTP сервер бота
+    и сразу попадают в application.update_queue, без long polling.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    # Тот же порядок, что в run_polling: initialize, post_init, start ... stop, shutdown, post_shutdown
+    await application.initialize()
+    try:
+        await post_init(application)
+        await application.start()
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL,
+            secret_token=webhook_secret,
+            allowed_updates=ALLOWED_UPDATES,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+        logger.info(f"Webhook установлен: {WEBHOOK_URL}")
+        await stop.wait()
+    finally:
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        await post_shutdown(application)
+
+
+def main():
+    """Запуск бота"""
+    application = build_application(build_bot())
 
     # Запускаем бота
     logger.info("Бот запускается...")
-    application.run_polling(allowed_updates=["message", "callback_query"])
+    if BOT_MODE == "webhook":
+        if not WEBHOOK_URL:
+            raise SystemExit("BOT_MODE=webhook требует WEBHOOK_URL")
+        asyncio.run(run_webhook(application))
+    else:
+        # run_polling сам снимает webhook, если он остался от режима webhook
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,410 @@
+"""
+Поиск автоответов по ключевым словам
+"""
+
+import re
+from collections import OrderedDict, deque, namedtuple
+from typing import Dict, Iterable, List, Optional, Tuple
+from config import AUTO_REPLIES, AUTO_REPLY_FUZZY, AUTO_REPLY_CACHE_SIZE
+
+# Результат поиска: текст ответа, совпавшее ключевое слово (как в конфиге),
+# балл по шкале 100/90/80/50 и номер элемента AUTO_REPLIES
+AutoReplyMatch = namedtuple("AutoReplyMatch", ["answer", "keyword", "score", "reply_index"])
+
+# Нечёткий уровень: ключи короче FUZZY_MIN_LENGTH символов не участвуют (слишком много
+# ложных срабатываний), допускается одна правка на каждые 4 символа ключа, проверяются
+# только FUZZY_CANDIDATES ключей с наибольшей долей общих триграмм
+FUZZY_MIN_LENGTH = 5
+FUZZY_MIN_OVERLAP = 0.4
+FUZZY_CANDIDATES = 5
+FUZZY_MAX_SCORE = 75
+
+_PUNCTUATION_RE = re.compile(r'[^\w\s]')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    """Нормализация текста для лучшего поиска"""
+    text = text.lower()
+    text = text.replace('ё', 'е')
+    text = _PUNCTUATION_RE.sub(' ', text)
+    text = _WHITESPACE_RE.sub(' ', text)
+    return text.strip()
+
+
+def trigrams(text: str) -> set:
+    """Символьные триграммы текста с пробелами по краям"""
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def bounded_levenshtein(a: str, b: str, limit: int) -> int:
+    """
+    Расстояние Левенштейна, если оно не больше limit, иначе limit + 1.
+    Считается только полоса шириной 2 * limit + 1 вокруг диагонали.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    # Общие начало и конец на расстояние не влияют - при опечатке это почти вся строка
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end_a, end_b = len(a), len(b)
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    a, b = a[start:end_a], b[start:end_b]
+    if not a or not b:
+        return min(max(len(a), len(b)), limit + 1)
+
+    too_far = limit + 1
+    # Из клетки (i, j) до конца нужно ещё не меньше |остаток a - остаток b| правок,
+    # поэтому полоса сужается с обеих сторон на разницу длин
+    shift = len(b) - len(a)
+    previous = [j if j <= limit else too_far for j in range(len(b) + 1)]
+    for i, char_a in enumerate(a, 1):
+        current = [i if i <= limit else too_far] + [too_far] * len(b)
+        low = max(1, i - limit, i + shift - limit)
+        high = min(len(b), i + limit, i + shift + limit)
+        for j in range(low, high + 1):
+            # min() из трёх вариантов без вызова функции - это самый горячий цикл
+            cost = previous[j - 1] if char_a == b[j - 1] else previous[j - 1] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            current[j] = cost
+        # Оценка снизу для итога через каждую клетку строки
+        if min(current[j] + abs(j - i - shift) for j in range(low - 1, high + 1)) > limit:
+            return too_far
+        previous = current
+    return min(previous[len(b)], too_far)
+
+
+class AhoCorasick:
+    """Автомат Ахо-Корасик: все вхождения набора строк за один проход по тексту"""
+
+    def __init__(self, patterns: List[str]):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+
+        for index, pattern in enumerate(patterns):
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[state][char] = next_state
+                state = next_state
+            self._out[state].append(index)
+
+        # Ссылки неудач строим обходом в ширину; у детей корня они ведут в корень
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._out[next_state] = self._out[next_state] + self._out[self._fail[next_state]]
+
+    def find(self, text: str) -> set:
+        """Номера всех шаблонов, входящих в text как подстрока"""
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if out[state]:
+                found.update(out[state])
+        return found
+
+
+class LRUCache:
+    """Ограниченный кэш с вытеснением давно не использованных ключей и счётчиками"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = max(0, maxsize)
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def lookup(self, key) -> Tuple[bool, object]:
+        """(найдено, значение); найденный ключ становится самым свежим"""
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return (False, None)
+        self._data.move_to_end(key)
+        self.hits += 1
+        return (True, value)
+
+    def store(self, key, value):
+        """Запомнить значение, вытеснив самый старый ключ при переполнении"""
+        if not self.maxsize:
+            return
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Сбросить содержимое (счётчики сохраняются)"""
+        self._data.clear()
+
+    def stats(self) -> dict:
+        """Снимок счётчиков для /test_auto"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+class AutoReplyMatcher:
+    """
+    Предварительно построенный индекс ключевых слов AUTO_REPLIES.
+
+    Подстроки ищутся автоматом Ахо-Корасик, совпадения по словам -
+    через инвертированный индекс слово -> ключевые слова. Баллы и выбор
+    ответа полностью совпадают с последовательным перебором ключей.
+
+    Если точные уровни ничего не нашли, включается нечёткий: кандидаты
+    берутся из индекса триграмм, а опечатки проверяются ограниченным
+    расстоянием Левенштейна. Балл нечёткого совпадения - от 56 до 75.
+
+    Результаты match кэшируются по нормализованному тексту; load()
+    перестраивает индекс и сбрасывает кэш.
+    """
+
+    def __init__(self, auto_replies: List[dict], fuzzy: bool = AUTO_REPLY_FUZZY,
+                 cache_size: int = AUTO_REPLY_CACHE_SIZE):
+        self.cache = LRUCache(cache_size)
+        self.load(auto_replies, fuzzy)
+
+    def load(self, auto_replies: List[dict], fuzzy: Optional[bool] = None):
+        """Построить индекс заново для новой конфигурации автоответов"""
+        self.auto_replies = auto_replies
+        if fuzzy is not None:
+            self.fuzzy = fuzzy
+        self._keywords = []      # исходные ключевые слова в порядке перебора
+        self._normalized = []    # они же после normalize_text
+        self._reply_index = []   # номер элемента auto_replies для ключа
+        self._always = []        # пустые после нормализации ключи - подстрока любого текста
+        self._phrase_words = {}  # слово -> ключи из нескольких слов, где оно есть
+        self._phrase_size = {}   # ключ из нескольких слов -> число разных слов в нём
+        self._single_words = {}  # слово -> ключи из одного слова
+        self._trigram_index = {} # триграмма -> ключи для нечёткого поиска
+        self._trigram_count = {} # ключ -> число его триграмм
+        self._trigram_sets = {}  # ключ -> его триграммы
+
+        for reply_index, reply_item in enumerate(auto_replies):
+            for keyword in reply_item["keywords"]:
+                index = len(self._keywords)
+                normalized = normalize_text(keyword)
+                self._keywords.append(keyword)
+                self._normalized.append(normalized)
+                self._reply_index.append(reply_index)
+
+                if not normalized:
+                    self._always.append(index)
+
+                words = normalized.split()
+                if len(words) > 1:
+                    unique_words = set(words)
+                    self._phrase_size[index] = len(unique_words)
+                    for word in unique_words:
+                        self._phrase_words.setdefault(word, []).append(index)
+                elif words:
+                    self._single_words.setdefault(words[0], []).append(index)
+
+                if len(normalized) >= FUZZY_MIN_LENGTH:
+                    keyword_trigrams = trigrams(normalized)
+                    self._trigram_count[index] = len(keyword_trigrams)
+                    self._trigram_sets[index] = keyword_trigrams
+                    for trigram in keyword_trigrams:
+                        self._trigram_index.setdefault(trigram, []).append(index)
+
+        self._automaton = AhoCorasick(self._normalized)
+        # Старые результаты относятся к прежней конфигурации
+        self.cache.clear()
+
+    def score_normalized(self, message_normalized: str) -> Dict[int, float]:
+        """Баллы всех сработавших ключей (номер ключа -> балл) для нормализованного текста"""
+        scores = {}
+
+        # 1-2. Точное совпадение или ключ целиком содержится в сообщении
+        for index in self._automaton.find(message_normalized).union(self._always):
+            scores[index] = 100 if self._normalized[index] == message_normalized else 90
+
+        message_words = set(message_normalized.split())
+
+        # 3. Все слова ключевой фразы есть в сообщении
+        found_words = {}
+        for word in message_words:
+            for index in self._phrase_words.get(word, ()):
+                found_words[index] = found_words.get(index, 0) + 1
+        for index, count in found_words.items():
+            if index not in scores and count == self._phrase_size[index]:
+                scores[index] = 80
+
+        # 4. Ключ из одного слова совпал со словом сообщения
+        for word in message_words:
+            for index in self._single_words.get(word, ()):
+                if index not in scores:
+                    scores[index] = 50.0
+
+        # 5. Нечёткое совпадение - только если точные уровни не дали балла выше
+        if self.fuzzy and (not scores or max(scores.values()) < FUZZY_MAX_SCORE):
+            for index, score in self._fuzzy_scores(message_normalized).items():
+                if score > scores.get(index, 0):
+                    scores[index] = score
+
+        return scores
+
+    def _fuzzy_scores(self, message_normalized: str) -> Dict[int, float]:
+        """Баллы ключей, отличающихся от фрагмента сообщения несколькими опечатками"""
+        shared = {}
+        for trigram in trigrams(message_normalized):
+            for index in self._trigram_index.get(trigram, ()):
+                shared[index] = shared.get(index, 0) + 1
+
+        candidates = [
+            index for index, count in shared.items()
+            if count >= FUZZY_MIN_OVERLAP * self._trigram_count[index]
+        ]
+        candidates.sort(key=lambda index: (-shared[index] / self._trigram_count[index], index))
+
+        message_words = message_normalized.split()
+        # Длина окна из слов [start, end) - по префиксным суммам длин слов
+        offsets = [0]
+        for word in message_words:
+            offsets.append(offsets[-1] + len(word) + 1)
+
+        # Окна и их триграммы общие для всех кандидатов: (начало, число слов) -> (текст, триграммы)
+        windows = {}
+
+        scores = {}
+        for index in candidates[:FUZZY_CANDIDATES]:
+            keyword = self._normalized[index]
+            limit = max(1, len(keyword) // 4)
+            width = keyword.count(" ") + 1
+            keyword_trigrams = self._trigram_sets[index]
+            best = limit + 1
+            # Сравниваем ключ с окнами из стольких же подряд идущих слов
+            for start in range(len(message_words) - width + 1):
+                # Интересны только окна лучше уже найденного: не дальше bound правок
+                bound = best - 1
+                if abs(offsets[start + width] - offsets[start] - 1 - len(keyword)) > bound:
+                    continue
+                cached = windows.get((start, width))
+                if cached is None:
+                    window = " ".join(message_words[start:start + width])
+                    cached = windows[(start, width)] = (window, trigrams(window))
+                window, window_trigrams = cached
+                # Каждая правка портит не больше 3 триграмм, поэтому у окна на расстоянии
+                # не больше bound общих с ключом триграмм хотя бы столько
+                if len(window_trigrams & keyword_trigrams) < self._trigram_count[index] - 3 * bound:
+                    continue
+                best = min(best, bounded_levenshtein(window, keyword, bound))
+                if best <= 1:
+                    break
+            if best <= limit:
+                scores[index] = FUZZY_MAX_SCORE * (1 - best / len(keyword))
+        return scores
+
+    def match_normalized(self, message_normalized: str) -> Optional[AutoReplyMatch]:
+        """Лучший автоответ для нормализованного текста или None (через кэш)"""
+        found, match = self.cache.lookup(message_normalized)
+        if not found:
+            match = self._best_match(message_normalized)
+            self.cache.store(message_normalized, match)
+        return match
+
+    def _best_match(self, message_normalized: str) -> Optional[AutoReplyMatch]:
+        """Выбрать лучший автоответ по баллам ключей"""
+        scores = self.score_normalized(message_normalized)
+        if not scores:
+            return None
+
+        # При равных баллах побеждает ключ, стоящий в конфиге раньше
+        best_index = min(scores, key=lambda index: (-scores[index], index))
+        best_score = scores[best_index]
+
+        # Порог для срабатывания: 50 (точное или частичное совпадение)
+        if best_score < 50:
+            return None
+        reply_index = self._reply_index[best_index]
+        return AutoReplyMatch(
+            self.auto_replies[reply_index]["answer"],
+            self._keywords[best_index],
+            best_score,
+            reply_index
+        )
+
+    def match(self, message_text: str) -> Optional[AutoReplyMatch]:
+        """Лучший автоответ для сообщения пользователя или None"""
+        return self.match_normalized(normalize_text(message_text))
+
+    def match_many(self, messages: Iterable[str]) -> List[Optional[AutoReplyMatch]]:
+        """
+        Автоответы для пачки сообщений в исходном порядке.
+        Одинаковые тексты нормализуются и оцениваются один раз; кэш
+        одиночных запросов не используется, чтобы не вытеснять живой трафик.
+        """
+        normalized_by_text = {}
+        match_by_normalized = {}
+        results = []
+        for message_text in messages:
+            normalized = normalized_by_text.get(message_text)
+            if normalized is None:
+                normalized = normalized_by_text[message_text] = normalize_text(message_text)
+            if normalized in match_by_normalized:
+                match = match_by_normalized[normalized]
+            else:
+                match = match_by_normalized[normalized] = self._best_match(normalized)
+            results.append(match)
+        return results
+
+
+# Индекс строится один раз при импорте
+matcher = AutoReplyMatcher(AUTO_REPLIES)
+
+
+def find_auto_reply(message_text: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Ищет подходящий автоответ по ключевым словам.
+    Возвращает (текст_ответа, совпавшее_ключевое_слово) или (None, None)
+    """
+    match = matcher.match(message_text)
+    if match is None:
+        return (None, None)
+    return (match.answer, match.keyword)
+
+
+def find_auto_replies(messages: Iterable[str]) -> List[Tuple[Optional[str], Optional[str]]]:
+    """
+    Пакетный вариант find_auto_reply для офлайн-оценки набора сообщений.
+    Возвращает список (текст_ответа, совпавшее_ключевое_слово) в порядке messages
+    """
+    return [
+        (None, None) if match is None else (match.answer, match.keyword)
+        for match in matcher.match_many(messages)
+    ]
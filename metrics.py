@@ -0,0 +1,197 @@
+"""
+Метрики бота в текстовом формате Prometheus (эндпоинт /metrics)
+"""
+
+import functools
+import threading
+import time
+from typing import Dict, List, Sequence, Tuple
+
+# Границы корзин гистограмм в секундах
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """Монотонный счётчик с метками"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        key = tuple(str(label) for label in labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(tuple(str(label) for label in labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value:g}" for key, value in items]
+
+
+class Gauge:
+    """Текущее значение с метками"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, *labels):
+        with self._lock:
+            self._values[tuple(str(label) for label in labels)] = value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value:g}" for key, value in items]
+
+
+class Histogram:
+    """Гистограмма длительностей с метками (накопительные корзины, сумма и число)"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счётчики по корзинам..., сумма, число]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        key = tuple(str(label) for label in labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, *labels) -> int:
+        series = self._series.get(tuple(str(label) for label in labels))
+        return series[-1] if series else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{bound:g}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Набор метрик, отдаваемых одним текстом"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+handler_latency = registry.register(Histogram(
+    "bot_handler_duration_seconds", "Время работы обработчика апдейта", ["handler"]
+))
+handler_errors = registry.register(Counter(
+    "bot_handler_errors_total", "Исключения в обработчиках", ["handler"]
+))
+db_query_latency = registry.register(Histogram(
+    "bot_db_query_duration_seconds", "Время запроса к SQLite в потоке БД", ["query"],
+    buckets=QUERY_BUCKETS
+))
+fanout_latency = registry.register(Histogram(
+    "bot_fanout_send_duration_seconds", "Время отправки уведомления менеджеру", ["manager"]
+))
+fanout_failures = registry.register(Counter(
+    "bot_fanout_failures_total", "Неудачные отправки уведомлений менеджеру", ["manager"]
+))
+auto_reply_matches = registry.register(Counter(
+    "bot_auto_reply_matches_total", "Сообщения пользователей с найденным автоответом", ["faq"]
+))
+outbound_calls = registry.register(Counter(
+    "bot_outbound_calls_total", "Вызовы Bot API через планировщик", ["method", "result"]
+))
+outbound_latency = registry.register(Histogram(
+    "bot_outbound_call_duration_seconds", "Длительность вызова Bot API", ["method"]
+))
+
+loop_lag = registry.register(Gauge(
+    "bot_event_loop_lag_seconds", "Текущая задержка event loop"
+))
+loop_lag_histogram = registry.register(Histogram(
+    "bot_event_loop_lag_distribution_seconds", "Распределение задержки event loop",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+))
+loop_stalls = registry.register(Counter(
+    "bot_event_loop_stalls_total", "Блокировки event loop дольше порога"
+))
+
+
+def timed_handler(callback):
+    """Обёртка обработчика PTB: длительность и исключения по имени функции"""
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            handler_latency.observe(time.perf_counter() - started, name)
+
+    return wrapper
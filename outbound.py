@@ -0,0 +1,319 @@
+"""
+Планировщик исходящих сообщений с учётом лимитов Telegram
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Awaitable, Callable, Dict, Optional
+from telegram.error import RetryAfter
+from config import (
+    OUTBOUND_GLOBAL_RATE,
+    OUTBOUND_CHAT_RATE,
+    OUTBOUND_CHAT_BURST,
+    OUTBOUND_GROUP_PER_MINUTE,
+    OUTBOUND_MAX_IN_FLIGHT,
+    OUTBOUND_MAX_RETRIES,
+)
+from metrics import outbound_calls, outbound_latency
+from profiling import section, SECTION_API
+
+# Классы приоритета: меньше - раньше
+PRIORITY_REPLY = 0          # ответ менеджера пользователю
+PRIORITY_INTERACTIVE = 1    # ответы на команды, кнопки и подтверждения
+PRIORITY_NOTIFICATION = 2   # уведомления менеджерам о сообщениях пользователей
+
+PRIORITY_NAMES = {
+    PRIORITY_REPLY: "reply",
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_NOTIFICATION: "notification",
+}
+
+
+class TokenBucket:
+    """Токен-бакет: rate токенов в секунду, не больше capacity про запас"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        # now мог быть прочитан до создания бакета: отрицательный интервал не снимает токены
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = max(self.updated, now)
+
+    def delay(self, now: float) -> float:
+        """Сколько секунд ждать до свободного токена (0 - можно отправлять)"""
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        """Запретить отправку на seconds секунд (ответ RetryAfter от Telegram)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class _Job:
+    """Одна исходящая отправка в очереди"""
+
+    __slots__ = ("chat_id", "call", "priority", "future", "attempts", "method", "timeout")
+
+    def __init__(self, chat_id: int, call: Callable[[], Awaitable], priority: int,
+                 future: asyncio.Future, method: str = "call", timeout: Optional[float] = None):
+        self.chat_id = chat_id
+        self.call = call
+        self.priority = priority
+        self.future = future
+        self.attempts = 0
+        self.method = method
+        self.timeout = timeout
+
+
+class OutboundScheduler:
+    """
+    Единая очередь исходящих вызовов Bot API.
+    Глобальный бакет и бакет на каждый чат, приоритеты и автоматический повтор после RetryAfter.
+    """
+
+    def __init__(self, global_rate: float = OUTBOUND_GLOBAL_RATE,
+                 chat_rate: float = OUTBOUND_CHAT_RATE,
+                 chat_burst: float = OUTBOUND_CHAT_BURST,
+                 group_per_minute: float = OUTBOUND_GROUP_PER_MINUTE,
+                 max_in_flight: int = OUTBOUND_MAX_IN_FLIGHT,
+                 max_retries: int = OUTBOUND_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_per_minute / 60
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._deferred = {}
+        self._in_flight = 0
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._tasks = set()
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+
+    def _ensure_started(self):
+        """Запустить диспетчер в текущем event loop (лениво, при первой отправке)"""
+        loop = asyncio.get_running_loop()
+        if self._dispatcher is not None and self._loop is loop and not self._dispatcher.done():
+            return
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._dispatcher = loop.create_task(self._dispatch())
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                # Группы: не больше group_per_minute сообщений в минуту. Лимит минутный,
+                # поэтому в запасе целая минута: пачка уходит сразу, а не по одному в 3 секунды
+                bucket = TokenBucket(self.group_rate, max(1.0, self.group_rate * 60))
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _push(self, job: _Job, seq: int):
+        heapq.heappush(self._heap, (job.priority, seq, job))
+        self._wakeup.set()
+
+    def _requeue(self, job: _Job, seq: int):
+        del self._deferred[seq]
+        self._push(job, seq)
+
+    def _defer(self, job: _Job, seq: int, delay: float):
+        self._deferred[seq] = (self._loop.call_later(delay, self._requeue, job, seq), job)
+
+    async def submit(self, chat_id: int, call: Callable[[], Awaitable],
+                     priority: int = PRIORITY_INTERACTIVE, method: str = "call",
+                     timeout: Optional[float] = None):
+        """
+        Поставить вызов в очередь и дождаться результата.
+        call - функция без аргументов, возвращающая корутину (нужна новая на каждый повтор),
+        method - имя метода Bot API для метрик, timeout - предел одного вызова в секундах
+        (ожидание лимита в очереди в него не входит).
+        """
+        self._ensure_started()
+        future = self._loop.create_future()
+        self._push(_Job(chat_id, call, priority, future, method, timeout), next(self._seq))
+        with section(SECTION_API, method):
+            return await future
+
+    async def _dispatch(self):
+        """Выдаёт задания по приоритету, когда есть токены чата и глобальный токен"""
+        last_prune = time.monotonic()
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            priority, seq, job = heapq.heappop(self._heap)
+            if job.future.done():
+                # Отправитель перестал ждать (таймаут или отмена)
+                self.dropped += 1
+                continue
+
+            now = time.monotonic()
+            chat_delay = self._bucket(job.chat_id).delay(now)
+            if chat_delay > 0:
+                # Чат упёрся в лимит - не задерживаем остальные чаты
+                self._defer(job, seq, chat_delay)
+                continue
+
+            global_delay = self._global.delay(now)
+            if global_delay > 0:
+                # Возвращаем задание: за время ожидания может прийти более приоритетное
+                heapq.heappush(self._heap, (priority, seq, job))
+                await asyncio.sleep(global_delay)
+                continue
+
+            await self._slots.acquire()
+            now = time.monotonic()
+            self._global.consume(now)
+            self._bucket(job.chat_id).consume(now)
+            self._in_flight += 1
+            task = self._loop.create_task(self._execute(job, seq))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+            if now - last_prune > 60:
+                self._prune(now)
+                last_prune = now
+
+    def _prune(self, now: float):
+        """Удалить бакеты чатов, которые давно ничего не отправляли"""
+        for chat_id in [chat_id for chat_id, bucket in self._chats.items() if bucket.is_idle(now)]:
+            del self._chats[chat_id]
+
+    async def _execute(self, job: _Job, seq: int):
+        job.attempts += 1
+        started = time.monotonic()
+        try:
+            if job.timeout:
+                result = await asyncio.wait_for(job.call(), job.timeout)
+            else:
+                result = await job.call()
+        except RetryAfter as e:
+            outbound_calls.inc(job.method, "retry_after")
+            self.retried += 1
+            self._bucket(job.chat_id).block(e.retry_after)
+            if job.attempts <= self.max_retries and not job.future.done():
+                self._defer(job, seq, e.retry_after)
+            else:
+                self.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+        except Exception as e:
+            outbound_calls.inc(job.method, "error")
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            outbound_calls.inc(job.method, "ok")
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            outbound_latency.observe(time.monotonic() - started, job.method)
+            self._in_flight -= 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        """Глубина очереди по приоритетам и счётчики отправок"""
+        queued = {name: 0 for name in PRIORITY_NAMES.values()}
+        for priority, _, job in self._heap:
+            if not job.future.done():
+                queued[PRIORITY_NAMES.get(priority, str(priority))] += 1
+        return {
+            "queued": queued,
+            "deferred": len(self._deferred),
+            "in_flight": self._in_flight,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "dropped": self.dropped,
+            "chats": len(self._chats),
+        }
+
+    async def close(self):
+        """Остановить диспетчер; ожидающие отправки завершаются с отменой"""
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        for handle, job in self._deferred.values():
+            handle.cancel()
+            job.future.cancel()
+        for _, _, job in self._heap:
+            job.future.cancel()
+        self._deferred.clear()
+        self._heap.clear()
+
+
+# Глобальный планировщик исходящих сообщений
+outbound = OutboundScheduler()
+
+
+async def send_message(bot, chat_id: int, text: str,
+                       priority: int = PRIORITY_INTERACTIVE, call_timeout: Optional[float] = None,
+                       **kwargs):
+    """bot.send_message через планировщик (call_timeout - предел самого вызова, без очереди)"""
+    return await outbound.submit(
+        chat_id,
+        lambda: bot.send_message(chat_id=chat_id, text=text, **kwargs),
+        priority,
+        "sendMessage",
+        call_timeout
+    )
+
+
+async def reply_text(message, text: str, priority: int = PRIORITY_INTERACTIVE, **kwargs):
+    """message.reply_text через планировщик"""
+    return await outbound.submit(
+        message.chat_id,
+        lambda: message.reply_text(text, **kwargs),
+        priority,
+        "sendMessage"
+    )
+
+
+async def edit_message_text(query, text: str, priority: int = PRIORITY_INTERACTIVE, **kwargs):
+    """query.edit_message_text через планировщик"""
+    chat_id = query.message.chat_id if query.message else query.from_user.id
+    return await outbound.submit(
+        chat_id,
+        lambda: query.edit_message_text(text=text, **kwargs),
+        priority,
+        "editMessageText"
+    )
@@ -0,0 +1,247 @@
+"""
+Выборочное профилирование обработки апдейтов.
+
+Для доли апдейтов (sample_rate) время обработки делится на участки:
+запросы к БД, поиск автоответа и ожидание вызовов Bot API; время, не
+покрытое ни одним участком, считается собственным кодом обработчиков.
+Параллельные участки (рассылка менеджерам) перекрываются, поэтому их
+сумма может превышать общее время апдейта. Работа, которую обработчик
+оставляет фоновой задаче (отправка серии сообщений после окна), выбирается
+отдельно и учитывается под своим видом. Пока идёт хотя бы один такой
+апдейт, включён cProfile. По команде dump накопленное пишется в файлы
+.pstats и .folded (формат flamegraph.pl / speedscope).
+"""
+
+import contextlib
+import contextvars
+import cProfile
+import os
+import random
+import threading
+import time
+from collections import Counter
+from typing import Optional
+from config import PROFILING_SAMPLE_RATE, PROFILING_DIR, PROFILING_CPROFILE
+
+# Участки, на которые делится время апдейта
+SECTION_DB = "db"
+SECTION_MATCHER = "matcher"
+SECTION_API = "api"
+SECTION_OTHER = "other"
+
+
+class UpdateProfile:
+    """Замеры одного апдейта"""
+
+    __slots__ = ("kind", "started", "wall", "sections", "calls",
+                 "covered", "_open", "_open_since")
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.started = time.perf_counter()
+        self.wall = 0.0
+        # (участок, метка) -> секунды; параллельные участки (рассылка) перекрываются
+        self.sections = Counter()
+        self.calls = Counter()
+        # Время, когда был открыт хотя бы один участок (без двойного счёта)
+        self.covered = 0.0
+        self._open = 0
+        self._open_since = 0.0
+
+    def enter(self, now: float):
+        if self._open == 0:
+            self._open_since = now
+        self._open += 1
+
+    def leave(self, section: str, label: str, started: float, now: float):
+        self.sections[(section, label)] += now - started
+        self.calls[(section, label)] += 1
+        self._open -= 1
+        if self._open == 0:
+            self.covered += now - self._open_since
+
+
+_current: contextvars.ContextVar[Optional[UpdateProfile]] = contextvars.ContextVar(
+    "current_profile", default=None
+)
+
+
+class section:
+    """
+    Замер участка для профилируемого апдейта; вне профилирования почти бесплатен.
+    Используется как with section(SECTION_DB, "is_manager"): await ...
+    """
+
+    __slots__ = ("name", "label", "profile", "started")
+
+    def __init__(self, name: str, label: str):
+        self.name = name
+        self.label = label
+
+    def __enter__(self):
+        self.profile = _current.get()
+        if self.profile is not None:
+            self.started = time.perf_counter()
+            self.profile.enter(self.started)
+        return self
+
+    def __exit__(self, *exc):
+        if self.profile is not None:
+            self.profile.leave(self.name, self.label, self.started, time.perf_counter())
+        return False
+
+
+def update_kind(update) -> str:
+    """Вид апдейта для отчёта: команда, сообщение или нажатие кнопки"""
+    if getattr(update, "callback_query", None):
+        return "callback_query"
+    message = getattr(update, "message", None)
+    text = getattr(message, "text", None) or ""
+    if text.startswith("/"):
+        return text.split()[0].split("@")[0]
+    return "message"
+
+
+class Profiler:
+    """Выборка апдейтов, агрегаты по участкам и общий cProfile"""
+
+    def __init__(self, sample_rate: float = PROFILING_SAMPLE_RATE,
+                 output_dir: str = PROFILING_DIR, use_cprofile: bool = PROFILING_CPROFILE):
+        self.sample_rate = sample_rate
+        self.output_dir = output_dir
+        self.use_cprofile = use_cprofile
+        self.sampled = 0
+        self.seen = 0
+        self.totals = Counter()       # (вид, участок, метка) -> секунды
+        self.wall = Counter()         # вид -> секунды
+        # CPU считается для процесса целиком: апдейты перемежаются в одном потоке,
+        # и разница thread_time() вокруг await досталась бы чужим апдейтам
+        self.cpu_started = time.process_time()
+        self.cpu_wall_started = time.perf_counter()
+        self._cprofile: Optional[cProfile.Profile] = None
+        self._active = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def configure(self, sample_rate: float):
+        """Включить (доля 0..1) или выключить (0) профилирование без перезапуска"""
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+
+    def reset(self):
+        with self._lock:
+            self.sampled = 0
+            self.seen = 0
+            self.totals.clear()
+            self.wall.clear()
+            self.cpu_started = time.process_time()
+            self.cpu_wall_started = time.perf_counter()
+            if self._active == 0:
+                self._cprofile = None
+
+    async def start_update(self, update, context):
+        """Обработчик в группе -1: решает, профилировать ли апдейт"""
+        previous = _current.get()
+        if previous is not None:
+            # Прошлый апдейт не дошёл до finish_update (обработчик прервал обработку)
+            self._finish(previous)
+        self._begin(update_kind(update))
+
+    async def finish_update(self, update, context):
+        """Обработчик в группе 1: завершает замер после основных обработчиков"""
+        profile = _current.get()
+        if profile is not None:
+            self._finish(profile)
+
+    @contextlib.contextmanager
+    def background(self, kind: str):
+        """
+        Замер фоновой задачи обработчика как отдельного апдейта вида kind.
+        Задача наследует контекст апдейта, который её создал, но тот замер
+        уже закрыт finish_update - поэтому участки задачи пишутся в свой.
+        """
+        _current.set(None)
+        profile = self._begin(kind)
+        try:
+            yield
+        finally:
+            if profile is not None and _current.get() is profile:
+                self._finish(profile)
+
+    def _begin(self, kind: str) -> Optional[UpdateProfile]:
+        """Решить по sample_rate, замерять ли, и начать замер в текущем контексте"""
+        if not self.enabled:
+            return None
+        self.seen += 1
+        if random.random() >= self.sample_rate:
+            return None
+
+        self.sampled += 1
+        if self.use_cprofile:
+            if self._cprofile is None:
+                self._cprofile = cProfile.Profile()
+            if self._active == 0:
+                self._cprofile.enable()
+        self._active += 1
+        profile = UpdateProfile(kind)
+        _current.set(profile)
+        return profile
+
+    def _finish(self, profile: UpdateProfile):
+        _current.set(None)
+        self._active = max(0, self._active - 1)
+        if self._active == 0 and self._cprofile is not None:
+            self._cprofile.disable()
+
+        profile.wall = time.perf_counter() - profile.started
+        profile.sections[(SECTION_OTHER, "")] += max(0.0, profile.wall - profile.covered)
+
+        with self._lock:
+            self.wall[profile.kind] += profile.wall
+            for (name, label), seconds in profile.sections.items():
+                self.totals[(profile.kind, name, label)] += seconds
+
+    def summary(self) -> dict:
+        """Доли участков по видам апдейтов для команды /profile"""
+        with self._lock:
+            by_kind = {}
+            for (kind, name, _), seconds in self.totals.items():
+                by_kind.setdefault(kind, Counter())[name] += seconds
+            return {
+                "sample_rate": self.sample_rate,
+                "seen": self.seen,
+                "sampled": self.sampled,
+                "wall": dict(self.wall),
+                "cpu": time.process_time() - self.cpu_started,
+                "cpu_wall": time.perf_counter() - self.cpu_wall_started,
+                "sections": by_kind,
+            }
+
+    def dump(self) -> list:
+        """Записать .folded и (если был cProfile) .pstats; возвращает пути файлов"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        paths = []
+
+        folded_path = os.path.join(self.output_dir, f"profile-{stamp}.folded")
+        with self._lock:
+            lines = [
+                f"{kind};{name}{';' + label if label else ''} {int(seconds * 1_000_000)}"
+                for (kind, name, label), seconds in sorted(self.totals.items())
+            ]
+        with open(folded_path, "w", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+        paths.append(folded_path)
+
+        if self._cprofile is not None:
+            pstats_path = os.path.join(self.output_dir, f"profile-{stamp}.pstats")
+            # dump_stats собирает статистику и при включённом профилировщике
+            self._cprofile.dump_stats(pstats_path)
+            paths.append(pstats_path)
+        return paths
+
+
+# Глобальный профилировщик (выключен, пока PROFILING_SAMPLE_RATE = 0)
+profiler = Profiler()
@@ -0,0 +1,187 @@
+"""
+Неблокирующее структурированное логирование.
+
+Обработчики и event loop только кладут запись в ограниченную очередь
+(QueueHandler); в stdout пишет отдельный поток (QueueListener). Записи
+получают поля update_id / user_id / handler текущего апдейта, формат -
+JSON по строке на запись. Одинаковые предупреждения и ошибки сверх
+LOG_RATE_LIMIT_BURST за LOG_RATE_LIMIT_WINDOW секунд подавляются.
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from typing import Optional
+from config import (
+    LOG_LEVEL,
+    LOG_FORMAT,
+    LOG_QUEUE_SIZE,
+    LOG_RATE_LIMIT_WINDOW,
+    LOG_RATE_LIMIT_BURST,
+)
+
+# Поля апдейта, который сейчас обрабатывается в этой задаче
+_log_context: contextvars.ContextVar[dict] = contextvars.ContextVar("log_context", default={})
+
+CONTEXT_FIELDS = ("update_id", "user_id", "handler")
+
+# Служебные атрибуты LogRecord - всё остальное считается полями из extra
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def with_log_context(callback):
+    """Обёртка обработчика PTB: поля апдейта попадают во все записи лога внутри него"""
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        user = getattr(update, "effective_user", None)
+        token = _log_context.set({
+            "update_id": getattr(update, "update_id", None),
+            "user_id": user.id if user else None,
+            "handler": name,
+        })
+        try:
+            return await callback(update, context)
+        finally:
+            _log_context.reset(token)
+
+    return wrapper
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет к записи поля текущего апдейта (выполняется в потоке, который пишет в лог)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, value in _log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Не больше burst одинаковых предупреждений и ошибок за window секунд.
+    Первая запись следующего окна сообщает, сколько было подавлено.
+    """
+
+    MAX_KEYS = 1000
+
+    def __init__(self, window: float = LOG_RATE_LIMIT_WINDOW, burst: int = LOG_RATE_LIMIT_BURST):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self._seen = {}   # ключ -> [начало окна, записей в окне, подавлено]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING or self.window <= 0:
+            return True
+        key = (record.name, record.levelno, record.getMessage())
+        now = time.monotonic()
+        with self._lock:
+            state = self._seen.get(key)
+            if state is None or now - state[0] >= self.window:
+                suppressed = state[2] if state else 0
+                if len(self._seen) >= self.MAX_KEYS:
+                    self._prune(now)
+                self._seen[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if state[1] < self.burst:
+                state[1] += 1
+                return True
+            state[2] += 1
+            return False
+
+    def _prune(self, now: float):
+        for key in [key for key, state in self._seen.items() if now - state[0] >= self.window]:
+            del self._seen[key]
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который при переполненной очереди отбрасывает запись, а не ждёт"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created))
+                  + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Прежний текстовый формат с полями апдейта в конце строки"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = [f"{key}={getattr(record, key)}" for key in CONTEXT_FIELDS + ("suppressed",)
+                  if getattr(record, key, None) is not None]
+        return f"{text} [{' '.join(fields)}]" if fields else text
+
+
+def setup_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT):
+    """Корневой логгер пишет через очередь; вывод в stdout - в фоновом потоке"""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(RateLimitFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler)
+    _listener.start()
+
+
+def stop_logging():
+    """Дописать очередь и остановить поток вывода (при завершении бота)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,57 @@
+"""
+Параллельная обработка апдейтов с сохранением порядка внутри одного чата
+"""
+
+import asyncio
+from typing import Any, Awaitable, Dict, Hashable
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+def order_key(update: object) -> Hashable:
+    """Апдейты с одинаковым ключом обрабатываются строго по очереди: один пользователь в одном чате"""
+    if not isinstance(update, Update):
+        return None
+    chat = update.effective_chat
+    user = update.effective_user
+    return (chat.id if chat else None, user.id if user else None)
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    До max_concurrent_updates апдейтов одновременно, но апдейты одного
+    пользователя в одном чате - по одному и в порядке поступления: серия
+    сообщений собирается в исходном порядке, а «первым» остаётся первое
+    сообщение. Медленный чат (ожидание лимита, запрос к БД) не задерживает
+    остальные.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        # Ключ -> [блокировка, сколько апдейтов её ждут или держат]
+        self._locks: Dict[Hashable, list] = {}
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = order_key(update)
+        if key is None:
+            await coroutine
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # Lock в asyncio честный (FIFO), а задачи апдейтов Application создаёт по очереди
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass